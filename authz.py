@@ -0,0 +1,51 @@
+# authz.py
+# in-memory banned / muted / sudo id sets, written through to their tables
+import logging
+from typing import Dict, Set
+
+from db import fetchall, execute
+
+logger = logging.getLogger("catch_character_bot.authz")
+
+TABLES = ("banned", "muted", "sudo")
+
+
+class AuthzCache:
+    """Id sets mirrored from the banned, muted and sudo tables.
+
+    Loaded once at startup; every write goes through ``add``/``remove`` so the
+    sets never go stale and permission checks never hit the database.
+    """
+
+    def __init__(self):
+        self.sets: Dict[str, Set[int]] = {t: set() for t in TABLES}
+
+    async def load(self):
+        for table in TABLES:
+            rows = await fetchall(f"SELECT id FROM {table}")
+            self.sets[table] = {r[0] for r in rows}
+        logger.info("loaded authz sets: %s", {t: len(s) for t, s in self.sets.items()})
+
+    def is_banned(self, uid: int) -> bool:
+        return uid in self.sets["banned"]
+
+    def is_muted(self, uid: int) -> bool:
+        return uid in self.sets["muted"]
+
+    def is_sudo(self, uid: int) -> bool:
+        return uid in self.sets["sudo"]
+
+    async def add(self, table: str, uid: int):
+        if table not in TABLES:
+            raise ValueError(f"unknown authz table: {table}")
+        await execute(f"INSERT OR IGNORE INTO {table} (id) VALUES (?)", (uid,))
+        self.sets[table].add(uid)
+
+    async def remove(self, table: str, uid: int):
+        if table not in TABLES:
+            raise ValueError(f"unknown authz table: {table}")
+        await execute(f"DELETE FROM {table} WHERE id = ?", (uid,))
+        self.sets[table].discard(uid)
+
+
+AUTHZ = AuthzCache()
@@ -0,0 +1,108 @@
+# backup.py
+# consistent DB snapshots + incremental asset archives, built off the event loop
+import os
+import json
+import asyncio
+import sqlite3
+import zipfile
+import logging
+from datetime import datetime
+from typing import Dict, NamedTuple
+
+logger = logging.getLogger("catch_character_bot.backup")
+
+BACKUP_DIR = "backups"
+ASSETS_DIR = "assets"
+MANIFEST_FILE = os.path.join(BACKUP_DIR, "manifest.json")
+
+# only one backup at a time; the archive build itself runs in a worker thread
+_BACKUP_LOCK = asyncio.Lock()
+
+
+class BackupResult(NamedTuple):
+    path: str
+    assets_added: int
+    size: int
+
+
+def _load_manifest() -> Dict:
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {"files": {}, "archives": []}
+
+
+def _save_manifest(manifest: Dict):
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh)
+    os.replace(tmp, MANIFEST_FILE)
+
+
+def _snapshot_db(db_file: str, dest: str):
+    """Copy the live database with SQLite's online backup API (safe under WAL)."""
+    src = sqlite3.connect(db_file)
+    dst = sqlite3.connect(dest)
+    try:
+        # one step: the copy reads a single WAL snapshot, so it never blocks the
+        # writer, while a stepped copy restarts whenever another connection commits
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _build_archive(db_file: str, full: bool) -> BackupResult:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    manifest = {"files": {}, "archives": []} if full else _load_manifest()
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    name = f"catch_backup_{stamp}{'_full' if full else ''}.zip"
+    n = 1
+    while os.path.exists(os.path.join(BACKUP_DIR, name)):
+        name = f"catch_backup_{stamp}_{n}{'_full' if full else ''}.zip"
+        n += 1
+    zip_path = os.path.join(BACKUP_DIR, name)
+    part_path = zip_path + ".part"
+    snap_path = os.path.join(BACKUP_DIR, f".snapshot_{stamp}.db")
+    seen = manifest["files"]
+    added = {}
+    try:
+        _snapshot_db(db_file, snap_path)
+        with zipfile.ZipFile(part_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.write(snap_path, arcname=os.path.basename(db_file))
+            for root, _, files in os.walk(ASSETS_DIR):
+                for f in files:
+                    full_path = os.path.join(root, f)
+                    arc = os.path.relpath(full_path, start=ASSETS_DIR)
+                    st = os.stat(full_path)
+                    sig = [st.st_size, st.st_mtime_ns]
+                    prev = seen.get(arc)
+                    if prev and prev[:2] == sig:
+                        continue
+                    # images/videos are already compressed; store them as-is
+                    zf.write(full_path, arcname=os.path.join("assets", arc), compress_type=zipfile.ZIP_STORED)
+                    added[arc] = sig + [name]
+        os.replace(part_path, zip_path)
+    finally:
+        for p in (snap_path, part_path):
+            if os.path.exists(p):
+                os.remove(p)
+    seen.update(added)
+    manifest["archives"].append(name)
+    _save_manifest(manifest)
+    return BackupResult(zip_path, len(added), os.path.getsize(zip_path))
+
+
+async def create_backup(db_file: str, full: bool = False) -> BackupResult:
+    """Write a backup archive into backups/ without blocking the event loop.
+
+    The archive always holds a fresh DB snapshot plus the assets added or
+    changed since the last backup (all of them when ``full``). Restoring
+    means the latest DB plus the assets of every archive listed in
+    ``backups/manifest.json`` since the last full one.
+    """
+    async with _BACKUP_LOCK:
+        result = await asyncio.to_thread(_build_archive, db_file, full)
+    logger.info("backup written: %s (%d new assets, %d bytes)", result.path, result.assets_added, result.size)
+    return result
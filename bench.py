@@ -0,0 +1,353 @@
+# bench.py
+# offline load test: drives the real handlers in main.py against a stub bot and a scratch database
+# Run: python3 bench.py [--cards N] [--users N] [--groups N] [--claimers N] [--json out.json]
+import os
+import sys
+import time
+import json
+import types
+import random
+import asyncio
+import argparse
+import logging
+import platform
+import shutil
+import tempfile
+import itertools
+from typing import Awaitable, Callable, Dict, List
+
+_SCRATCH = tempfile.mkdtemp(prefix="bench_")
+# must be set before db/main are imported: DB_FILE is read at import time
+os.environ["DB_FILE"] = os.path.join(_SCRATCH, "bench.db")
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _HERE)
+
+_MSG_IDS = itertools.count(1000)
+
+
+# ---------------- fake Telegram ----------------
+class StubBot:
+    """Answers every Bot API coroutine (send_photo, edit_message_text, ...) with a fake Message."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return _fake_message(kwargs.get("chat_id", 0))
+        return call
+
+
+def _fake_message(chat_id: int):
+    mid = next(_MSG_IDS)
+    return types.SimpleNamespace(message_id=mid, chat_id=chat_id,
+                                 photo=[types.SimpleNamespace(file_id=f"bench-photo-{mid}")],
+                                 video=types.SimpleNamespace(file_id=f"bench-video-{mid}"))
+
+
+def _user(uid: int):
+    return types.SimpleNamespace(id=uid, is_bot=False, first_name=f"user{uid}", full_name=f"user{uid}",
+                                 username=f"user{uid}")
+
+
+def _chat(chat_id: int):
+    return types.SimpleNamespace(id=chat_id, type="supergroup" if chat_id < 0 else "private")
+
+
+def _message(bot: StubBot, uid: int, chat_id: int, text: str = "hi", photo: bool = False):
+    return types.SimpleNamespace(message_id=next(_MSG_IDS), chat_id=chat_id, chat=_chat(chat_id), from_user=_user(uid),
+                                 text=text, caption=None, document=None, reply_to_message=None,
+                                 photo=[object()] if photo else None, video=None,
+                                 reply_text=bot.send_message, reply_photo=bot.send_photo, reply_video=bot.send_video)
+
+
+def message_update(bot: StubBot, uid: int, chat_id: int, text: str = "hi"):
+    m = _message(bot, uid, chat_id, text)
+    return types.SimpleNamespace(message=m, effective_message=m, effective_user=m.from_user,
+                                 effective_chat=m.chat, callback_query=None, inline_query=None)
+
+
+def callback_update(bot: StubBot, uid: int, chat_id: int, data: str):
+    m = _message(bot, uid, chat_id, photo=chat_id < 0)
+    q = types.SimpleNamespace(id=str(next(_MSG_IDS)), data=data, from_user=_user(uid), message=m,
+                              inline_message_id=None, answer=bot.answer_callback_query,
+                              edit_message_text=bot.edit_message_text,
+                              edit_message_caption=bot.edit_message_caption,
+                              edit_message_reply_markup=bot.edit_message_reply_markup)
+    return types.SimpleNamespace(message=None, effective_message=m, effective_user=q.from_user,
+                                 effective_chat=m.chat, callback_query=q, inline_query=None)
+
+
+def inline_update(bot: StubBot, uid: int, query: str):
+    iq = types.SimpleNamespace(id=str(next(_MSG_IDS)), query=query, from_user=_user(uid), answer=bot.answer_inline_query)
+    return types.SimpleNamespace(message=None, effective_message=None, effective_user=iq.from_user,
+                                 effective_chat=None, callback_query=None, inline_query=iq)
+
+
+def context_for(bot: StubBot, args=()):
+    return types.SimpleNamespace(bot=bot, args=list(args), bot_data={"OWNER_ID": 1}, user_data={}, chat_data={})
+
+
+# ---------------- measurement ----------------
+def _percentile(sorted_vals: List[float], pct: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(pct / 100.0 * len(sorted_vals))) - 1))
+    return sorted_vals[idx]
+
+
+async def run_scenario(name: str, calls: List[Callable[[], Awaitable]], concurrency: int) -> dict:
+    """Run every call (at most `concurrency` at a time) and summarize per-call latency."""
+    latencies: List[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(call):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await call()
+            except Exception as e:
+                errors += 1
+                logging.getLogger("catch_character_bot.bench").debug("%s call failed: %s", name, e)
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one(c) for c in calls])
+    wall = time.perf_counter() - t0
+    await _drain_background()
+    latencies.sort()
+    ms = [x * 1000 for x in latencies]
+    return {
+        "scenario": name,
+        "calls": len(calls),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 4),
+        "throughput_per_s": round(len(calls) / wall, 1) if wall > 0 else None,
+        "p50_ms": round(_percentile(ms, 50), 3),
+        "p90_ms": round(_percentile(ms, 90), 3),
+        "p99_ms": round(_percentile(ms, 99), 3),
+        "max_ms": round(ms[-1], 3) if ms else 0.0,
+    }
+
+
+async def _drain_background():
+    """Let sends the handlers queued (outbox inline tasks) finish before the next scenario."""
+    current = asyncio.current_task()
+    for _ in range(50):
+        pending = [t for t in asyncio.all_tasks() if t is not current and not t.done()]
+        if not pending:
+            return
+        await asyncio.sleep(0.01)
+
+
+# ---------------- fixtures ----------------
+NAMES = ["naruto", "sasuke", "luffy", "zoro", "goku", "vegeta", "mikasa", "levi", "tanjiro", "nezuko",
+         "gojo", "itadori", "light", "ryuk", "saitama", "rem", "emilia", "asuna", "kirito", "edward"]
+MOVIES = ["naruto", "one piece", "dragon ball", "attack on titan", "demon slayer", "jujutsu kaisen",
+          "death note", "one punch man", "re zero", "sword art online", "fullmetal alchemist"]
+
+
+async def seed(db, args, rng: random.Random):
+    from utils import RARITY_LEVELS, RARITY_WEIGHTS
+    keys = [k for k, _ in RARITY_LEVELS]
+    labels = dict(RARITY_LEVELS)
+    rows = []
+    for i in range(args.cards):
+        rk = rng.choices(keys, weights=RARITY_WEIGHTS, k=1)[0]
+        ftype = "video" if rk == "animated" else "photo"
+        rows.append((f"{rng.choice(NAMES)} {i}", rng.choice(MOVIES), labels[rk], rk, ftype,
+                     f"bench-{ftype}-{i}", None, 0, "2024-01-01T00:00:00"))
+    async with db.transaction():
+        await db.execute_many("INSERT INTO cards (name,movie,rarity,rarity_key,file_type,file_id,file_path,owner_id,created_at) "
+                              "VALUES (?,?,?,?,?,?,?,?,?)", rows)
+        await db.execute_many("INSERT OR REPLACE INTO users (id, coins) VALUES (?, ?)",
+                              [(uid, 1_000_000) for uid in _user_ids(args)])
+    # give every user a few cards so /harem has pages to show
+    owned = min(args.cards // 4, args.users * args.harem_cards)
+    async with db.transaction():
+        await db.execute_many("UPDATE cards SET owner_id = ? WHERE id = ?",
+                              [(_user_ids(args)[i % args.users], i + 1) for i in range(owned)])
+
+
+def _user_ids(args) -> List[int]:
+    return list(range(10_000, 10_000 + args.users))
+
+
+def _group_ids(args) -> List[int]:
+    return [-1_000_000_000_000 - g for g in range(args.groups)]
+
+
+# ---------------- scenarios ----------------
+async def bench(args) -> dict:
+    import db
+    import main as bot_main
+    # main.py configures INFO logging on import; per-call logs would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    from counters import COUNTERS
+    from cardpool import POOL
+    from authz import AUTHZ
+    from settings import SETTINGS
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    os.chdir(_SCRATCH)
+    await db.init_db_and_dirs()
+    try:
+        t0 = time.perf_counter()
+        await seed(db, args, rng)
+        seed_s = time.perf_counter() - t0
+        await COUNTERS.load()
+        await POOL.load()
+        await AUTHZ.load()
+        await SETTINGS.load()
+
+        bot = StubBot(args.api_latency)
+        users, groups = _user_ids(args), _group_ids(args)
+        results = []
+
+        def scenario(name: str, calls, concurrency=None):
+            if args.only and name not in args.only:
+                return None
+            return run_scenario(name, calls, concurrency or args.concurrency)
+
+        async def add(name, calls, concurrency=None):
+            coro = scenario(name, calls, concurrency)
+            if coro is not None:
+                res = await coro
+                results.append(res)
+                _print_row(res)
+
+        _print_header()
+
+        # every group message counts; one in drop_number of them drops a card
+        await add("group_message", [
+            (lambda u=rng.choice(users), g=rng.choice(groups):
+             bot_main.on_group_message(message_update(bot, u, g), context_for(bot)))
+            for _ in range(args.messages)])
+
+        # independent claims: each user grabs a different unowned card
+        free = [r[0] for r in await db.fetchall("SELECT id FROM cards WHERE owner_id = 0 ORDER BY id LIMIT ?", (args.claims,))]
+        await add("claim", [
+            (lambda cid=cid, u=users[i % len(users)], g=rng.choice(groups):
+             bot_main.cb_claim(callback_update(bot, u, g, f"claim:{g}:{cid}"), context_for(bot)))
+            for i, cid in enumerate(free)])
+
+        # contention: `claimers` users press Claim on the same drop at once
+        contested = [r[0] for r in await db.fetchall("SELECT id FROM cards WHERE owner_id = 0 ORDER BY id DESC LIMIT ?",
+                                                     (args.contested_drops,))]
+        calls = []
+        for cid in contested:
+            g = rng.choice(groups)
+            calls += [(lambda cid=cid, u=u, g=g:
+                       bot_main.cb_claim(callback_update(bot, u, g, f"claim:{g}:{cid}"), context_for(bot)))
+                      for u in rng.sample(users, min(args.claimers, len(users)))]
+        await add("claim_contention", calls, concurrency=max(args.concurrency, args.claimers))
+        if contested and (not args.only or "claim_contention" in args.only):
+            q = ",".join("?" * len(contested))
+            owned = (await db.fetchone(f"SELECT COUNT(*) FROM cards WHERE id IN ({q}) AND owner_id != 0", tuple(contested)))[0]
+            results[-1]["winners"] = owned
+            results[-1]["expected_winners"] = len(contested)
+
+        from utils import ITEM_LIST
+        await add("shop_page", [
+            (lambda u=rng.choice(users), p=rng.randrange(len(ITEM_LIST)):
+             bot_main.cb_shop(callback_update(bot, u, u, f"shop:page:{p}"), context_for(bot)))
+            for _ in range(args.shop_ops)])
+        await add("shop_buy", [
+            (lambda u=rng.choice(users), p=rng.randrange(len(ITEM_LIST) - 1):
+             bot_main.cb_shop(callback_update(bot, u, u, f"shopbuy:{ITEM_LIST[p][0]}:{p}"), context_for(bot)))
+            for _ in range(args.shop_ops)])
+
+        queries = [rng.choice(NAMES)[:rng.randint(2, 6)] for _ in range(args.inline_ops // 2)]
+        queries += [rng.choice(MOVIES) for _ in range(args.inline_ops - len(queries))]
+        rng.shuffle(queries)
+        await add("inline_search", [
+            (lambda u=rng.choice(users), q=q: bot_main.inline_search(inline_update(bot, u, q), context_for(bot)))
+            for q in queries])
+
+        await add("harem", [
+            (lambda u=rng.choice(users): bot_main.cmd_harem(message_update(bot, u, u, "/harem"), context_for(bot)))
+            for _ in range(args.harem_ops)])
+
+        # first call per user claims, the rest hit the 24h cooldown
+        daily_users = [rng.choice(users) for _ in range(args.daily_ops)]
+        await add("daily", [
+            (lambda u=u: bot_main.cmd_daily(message_update(bot, u, u, "/daily"), context_for(bot)))
+            for u in daily_users])
+
+        await COUNTERS.stop()
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "seed_s": round(seed_s, 3),
+            },
+            "config": {k: v for k, v in vars(args).items() if k not in ("json",)},
+            "api_calls": bot.calls,
+            "results": results,
+        }
+    finally:
+        await db.close_db()
+
+
+def _print_header():
+    print(f"{'scenario':<18}{'calls':>8}{'err':>6}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+
+def _print_row(r: dict):
+    print(f"{r['scenario']:<18}{r['calls']:>8}{r['errors']:>6}{r['throughput_per_s'] or 0:>10.1f}"
+          f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['max_ms']:>10.3f}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the bot's hot handlers offline")
+    p.add_argument("--cards", type=int, default=20000, help="catalogue size")
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--groups", type=int, default=50)
+    p.add_argument("--claimers", type=int, default=100, help="users pressing Claim on one drop")
+    p.add_argument("--contested-drops", type=int, default=20)
+    p.add_argument("--messages", type=int, default=20000, help="group messages to feed on_group_message")
+    p.add_argument("--claims", type=int, default=2000)
+    p.add_argument("--shop-ops", type=int, default=1000)
+    p.add_argument("--inline-ops", type=int, default=2000)
+    p.add_argument("--harem-ops", type=int, default=2000)
+    p.add_argument("--harem-cards", type=int, default=30, help="cards pre-owned per user")
+    p.add_argument("--daily-ops", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=50, help="handler calls in flight at once")
+    p.add_argument("--api-latency", type=float, default=0.0, help="seconds each stub Bot API call takes")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--only", nargs="*", help="run only these scenarios")
+    p.add_argument("--json", help="write machine-readable results to this file ('-' for stdout)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json and args.json != "-":
+        args.json = os.path.abspath(args.json)  # bench() chdirs into the scratch dir
+    try:
+        report = asyncio.run(bench(args))
+    finally:
+        shutil.rmtree(_SCRATCH, ignore_errors=True)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# cardpool.py
+# in-memory pool of unowned card ids, keyed by rarity, with O(1) pick/remove and per-rarity counts
+import logging
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db import fetchall
+
+logger = logging.getLogger("catch_character_bot.cardpool")
+
+# listener(rarity_key, available) -- called when a rarity's pool empties (False) or refills (True)
+RarityListener = Callable[[str, bool], None]
+
+
+class IdBag:
+    """Set of ints with O(1) add, discard and uniform random choice."""
+
+    def __init__(self):
+        self._items: List[int] = []
+        self._index: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item: int):
+        return item in self._index
+
+    def add(self, item: int):
+        if item in self._index:
+            return
+        self._index[item] = len(self._items)
+        self._items.append(item)
+
+    def discard(self, item: int):
+        pos = self._index.pop(item, None)
+        if pos is None:
+            return
+        last = self._items.pop()
+        if pos < len(self._items):
+            # move the tail element into the freed slot
+            self._items[pos] = last
+            self._index[last] = pos
+
+    def choice(self, rng=random) -> Optional[int]:
+        if not self._items:
+            return None
+        return self._items[rng.randrange(len(self._items))]
+
+
+class UnownedPool:
+    """Unowned card ids, overall and per rarity_key.
+
+    Built from ``cards`` at startup and kept in sync by upload (``add``) and
+    claim/buy (``remove``), so drops and shop purchases never scan the table.
+    It also counts every card per rarity, so available/owned figures for
+    the shop and /cardstats come from memory too (owned = total - available).
+    """
+
+    def __init__(self):
+        self._listeners: List[RarityListener] = []
+        self._reset()
+
+    def _reset(self):
+        self._all = IdBag()
+        self._by_rarity: Dict[str, IdBag] = {}
+        self._rarity_of: Dict[int, str] = {}
+        self._total: Dict[str, int] = {}
+
+    def __contains__(self, card_id: int):
+        return card_id in self._rarity_of
+
+    def on_rarity_change(self, listener: RarityListener):
+        self._listeners.append(listener)
+
+    def _notify(self, rarity_key: str, available: bool):
+        for listener in self._listeners:
+            try:
+                listener(rarity_key, available)
+            except Exception as e:
+                logger.exception("pool listener failed: %s", e)
+
+    async def load(self):
+        before = set(self._by_rarity)
+        listeners = self._listeners
+        self._listeners = []  # no per-card notifications while rebuilding
+        try:
+            self._reset()
+            rows = await fetchall("SELECT id, rarity_key FROM cards WHERE owner_id = 0")
+            for cid, rarity_key in rows:
+                self._insert(cid, rarity_key or "")
+            totals = await fetchall("SELECT rarity_key, COUNT(*) FROM cards GROUP BY rarity_key")
+            self._total = {(rk or ""): n for rk, n in totals}
+        finally:
+            self._listeners = listeners
+        for rarity_key in before | set(self._by_rarity):
+            self._notify(rarity_key, self.available(rarity_key) > 0)
+        logger.info("loaded %d unowned cards into pool (%d cards in total)", len(rows), sum(self._total.values()))
+
+    def add(self, card_id: int, rarity_key: Optional[str]):
+        """A new unowned card was inserted."""
+        rarity_key = rarity_key or ""
+        if card_id in self._rarity_of:
+            return
+        self._insert(card_id, rarity_key)
+        self._total[rarity_key] = self._total.get(rarity_key, 0) + 1
+
+    def _insert(self, card_id: int, rarity_key: str):
+        self._all.add(card_id)
+        self._rarity_of[card_id] = rarity_key
+        bag = self._by_rarity.setdefault(rarity_key, IdBag())
+        bag.add(card_id)
+        if len(bag) == 1:
+            self._notify(rarity_key, True)
+
+    def remove(self, card_id: int):
+        rarity_key = self._rarity_of.pop(card_id, None)
+        if rarity_key is None:
+            return
+        self._all.discard(card_id)
+        bag = self._by_rarity[rarity_key]
+        bag.discard(card_id)
+        if not bag:
+            self._notify(rarity_key, False)
+
+    def pick(self, rarity_key: Optional[str] = None) -> Optional[int]:
+        """Uniform random unowned card id (optionally of one rarity), or None."""
+        if rarity_key is None:
+            return self._all.choice()
+        bag = self._by_rarity.get(rarity_key)
+        return bag.choice() if bag else None
+
+    def available(self, rarity_key: Optional[str] = None) -> int:
+        if rarity_key is None:
+            return len(self._all)
+        bag = self._by_rarity.get(rarity_key)
+        return len(bag) if bag else 0
+
+    def owned(self, rarity_key: Optional[str] = None) -> int:
+        if rarity_key is None:
+            return sum(self._total.values()) - len(self._all)
+        return self._total.get(rarity_key, 0) - self.available(rarity_key)
+
+    def counts(self) -> Dict[str, Tuple[int, int]]:
+        """rarity_key -> (available, owned) for every rarity that has cards."""
+        return {rk: (self.available(rk), self.owned(rk)) for rk in self._total}
+
+
+POOL = UnownedPool()
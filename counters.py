@@ -0,0 +1,89 @@
+# counters.py
+# in-memory per-chat drop counters with write-behind flush to groups_seen
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from db import fetchall, execute_many
+
+logger = logging.getLogger("catch_character_bot.counters")
+
+FLUSH_INTERVAL = 30.0
+
+
+class DropCounters:
+    """Per-chat messages_count / last_drop_card_id kept in memory.
+
+    Message handling only touches the dicts below; dirty chats are written back
+    to ``groups_seen`` in one batched transaction by ``flush()``, which runs
+    periodically and on shutdown.
+    """
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.last_drop: Dict[int, int] = {}
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        rows = await fetchall("SELECT chat_id, messages_count, last_drop_card_id FROM groups_seen")
+        for chat_id, count, last_drop in rows:
+            self.counts[chat_id] = count or 0
+            self.last_drop[chat_id] = last_drop or 0
+        logger.info("loaded drop counters for %d chats", len(rows))
+
+    def hit(self, chat_id: int, drop_n: int) -> bool:
+        """Count one message; return True (and reset the counter) when a drop is due."""
+        count = self.counts.get(chat_id, 0) + 1
+        self._dirty.add(chat_id)
+        if count >= drop_n:
+            self.counts[chat_id] = 0
+            return True
+        self.counts[chat_id] = count
+        return False
+
+    def set_last_drop(self, chat_id: int, card_id: int):
+        self.last_drop[chat_id] = card_id
+        self._dirty.add(chat_id)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows: List[tuple] = [(cid, self.counts.get(cid, 0), self.last_drop.get(cid, 0)) for cid in dirty]
+        try:
+            await execute_many(
+                "INSERT INTO groups_seen (chat_id, messages_count, last_drop_card_id) VALUES (?,?,?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET messages_count = excluded.messages_count, "
+                "last_drop_card_id = excluded.last_drop_card_id",
+                rows,
+            )
+        except Exception:
+            # keep them dirty so the next flush retries
+            self._dirty |= dirty
+            raise
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception("counter flush failed: %s", e)
+
+    def start(self, interval: float = FLUSH_INTERVAL):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+COUNTERS = DropCounters()
@@ -1,14 +1,67 @@
 
-# part2_db.py
+# db.py
 # DB layer: connection, initialization, and convenience helpers
 import os
+import time
+import asyncio
+import contextvars
 import aiosqlite
-from typing import Optional, Any, Sequence, Tuple, List
-from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Optional, Any, Callable, Sequence, Tuple, List
+
+import metrics
+import migrations
 
 DB_FILE = os.getenv('DB_FILE', 'bot.db')
+# the single writer connection; execute/execute_many/transaction use it
 DB: Optional[aiosqlite.Connection] = None
 
+# connection tuning, applied to the writer and every reader
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()
+DB_CACHE_MB = int(os.getenv('DB_CACHE_MB', '16'))
+DB_MMAP_MB = int(os.getenv('DB_MMAP_MB', '256'))
+
+# read-only WAL connections for fetchone/fetchall (0 = read through DB)
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+_READERS: Optional[asyncio.Queue] = None
+_READER_CONNS: List[aiosqlite.Connection] = []
+
+# group commit: when > 0, writes outside a transaction() are committed together
+# every GROUP_COMMIT_MS milliseconds instead of one commit per statement
+GROUP_COMMIT_MS = float(os.getenv('GROUP_COMMIT_MS', '0'))
+
+# serializes writers on the single connection so transactions don't interleave
+_WRITE_LOCK = asyncio.Lock()
+# savepoint depth of the transaction() open in the current task (0 = none)
+_TX_DEPTH: contextvars.ContextVar[int] = contextvars.ContextVar('tx_depth', default=0)
+_PENDING_COMMIT: Optional[asyncio.Future] = None
+# callbacks to run once the current task's transaction() has committed
+_ON_COMMIT: contextvars.ContextVar[Optional[List[Callable[[], None]]]] = contextvars.ContextVar('on_commit', default=None)
+
+# tokenizer of the cards_fts index ('trigram' / 'unicode61'), None if FTS5 is unavailable
+FTS_TOKENIZER: Optional[str] = None
+# cards_fts_short (word prefixes, for 1-2 character queries) exists next to a trigram cards_fts
+FTS_SHORT = False
+
+class _WriterLock:
+    """``async with _WRITER`` takes _WRITE_LOCK, recording the wait when metrics are on."""
+
+    async def __aenter__(self):
+        if metrics.METRICS_ENABLED:
+            t0 = time.perf_counter()
+            await _WRITE_LOCK.acquire()
+            metrics.METRICS.observe("db_lock_wait_seconds", time.perf_counter() - t0)
+        else:
+            await _WRITE_LOCK.acquire()
+
+    async def __aexit__(self, *exc):
+        _WRITE_LOCK.release()
+
+_WRITER = _WriterLock()
+
+class Rollback(Exception):
+    """Raise inside transaction() to roll it back without propagating."""
+
 async def init_db_and_dirs():
     global DB
     os.makedirs('assets/images', exist_ok=True)
@@ -16,71 +69,283 @@ async def init_db_and_dirs():
     os.makedirs('backups', exist_ok=True)
     DB = await aiosqlite.connect(DB_FILE)
     await DB.execute("PRAGMA journal_mode=WAL;")
-    # simple helper function to return lastrowid
-    await _create_schema()
+    await _tune(DB)
+    await migrations.migrate(DB)
+    await _detect_search_index()
+    await _open_readers()
 
-async def _create_schema():
-    global DB
+async def _tune(conn: aiosqlite.Connection):
+    """Per-connection PRAGMAs (none of these persist in the file)."""
+    # NORMAL under WAL: a crash can't corrupt, a power cut may lose the last commits
+    await conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    await conn.execute(f"PRAGMA cache_size={-DB_CACHE_MB * 1024}")
+    await conn.execute(f"PRAGMA mmap_size={DB_MMAP_MB * 1024 * 1024}")
+    await conn.execute("PRAGMA temp_store=MEMORY")
+
+async def _open_readers():
+    """Open DB_READERS read-only connections, each with its own aiosqlite thread."""
+    global _READERS
+    if DB_READERS <= 0 or DB_FILE == ':memory:':
+        return
+
+    async def connect():
+        conn = await aiosqlite.connect(f"file:{os.path.abspath(DB_FILE)}?mode=ro", uri=True)
+        await _tune(conn)
+        return conn
+
+    _READER_CONNS.extend(await asyncio.gather(*(connect() for _ in range(DB_READERS))))
+    _READERS = asyncio.Queue()
+    for conn in _READER_CONNS:
+        _READERS.put_nowait(conn)
+
+async def _detect_search_index():
+    global DB, FTS_TOKENIZER, FTS_SHORT
     assert DB is not None
-    await DB.executescript("""
-    CREATE TABLE IF NOT EXISTS cards (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        movie TEXT,
-        rarity TEXT,
-        rarity_key TEXT,
-        file_type TEXT,
-        file_id TEXT,
-        file_path TEXT,
-        owner_id INTEGER DEFAULT 0,
-        created_at TEXT
-    );
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        username TEXT,
-        coins INTEGER DEFAULT 0
-    );
-    CREATE TABLE IF NOT EXISTS daily (user_id INTEGER PRIMARY KEY, last_claim TEXT);
-    CREATE TABLE IF NOT EXISTS banned (id INTEGER PRIMARY KEY);
-    CREATE TABLE IF NOT EXISTS muted (id INTEGER PRIMARY KEY);
-    CREATE TABLE IF NOT EXISTS sudo (id INTEGER PRIMARY KEY);
-    CREATE TABLE IF NOT EXISTS groups_seen (chat_id INTEGER PRIMARY KEY, messages_count INTEGER DEFAULT 0, last_drop_card_id INTEGER DEFAULT 0);
-    CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
-    """)
-    await DB.commit()
+    async with DB.execute("SELECT name, sql FROM sqlite_master WHERE name IN ('cards_fts', 'cards_fts_short')") as cur:
+        rows = dict(await cur.fetchall())
+    if 'cards_fts' in rows:
+        FTS_TOKENIZER = 'trigram' if 'trigram' in rows['cards_fts'] else 'unicode61'
+    FTS_SHORT = 'cards_fts_short' in rows
 
 async def close_db():
-    global DB
+    global DB, _READERS
+    _READERS = None
+    while _READER_CONNS:
+        await _READER_CONNS.pop().close()
     if DB:
+        async with _WRITE_LOCK:
+            if DB.in_transaction:
+                await DB.commit()
+            # refresh planner stats for indexes the migrations added
+            await DB.execute("PRAGMA optimize")
         await DB.close()
         DB = None
 
 # convenience helpers
-async def fetchone(query: str, params: Sequence[Any] = ()) -> Optional[Tuple[Any, ...]]:
+@asynccontextmanager
+async def _reader():
+    """Borrow a reader connection; inside a transaction() read through the writer."""
     global DB
     assert DB is not None
-    async with DB.execute(query, params) as cur:
-        return await cur.fetchone()
+    readers = _READERS
+    if readers is None or _TX_DEPTH.get():
+        yield DB
+        return
+    conn = await readers.get()
+    try:
+        yield conn
+    finally:
+        readers.put_nowait(conn)
+
+async def fetchone(query: str, params: Sequence[Any] = ()) -> Optional[Tuple[Any, ...]]:
+    t0 = time.perf_counter() if metrics.TIMING else 0.0
+    async with _reader() as conn:
+        async with conn.execute(query, params) as cur:
+            row = await cur.fetchone()
+    if t0:
+        metrics.observe_query("fetchone", query, time.perf_counter() - t0)
+    return row
 
 async def fetchall(query: str, params: Sequence[Any] = ()) -> List[Tuple[Any, ...]]:
+    t0 = time.perf_counter() if metrics.TIMING else 0.0
+    async with _reader() as conn:
+        async with conn.execute(query, params) as cur:
+            rows = await cur.fetchall()
+    if t0:
+        metrics.observe_query("fetchall", query, time.perf_counter() - t0)
+    return rows
+
+async def _timed_execute(query: str, params: Sequence[Any]) -> aiosqlite.Cursor:
+    if not metrics.TIMING:
+        return await DB.execute(query, params)
+    t0 = time.perf_counter()
+    cur = await DB.execute(query, params)
+    metrics.observe_query("execute", query, time.perf_counter() - t0)
+    return cur
+
+async def _timed_executemany(query: str, params_list: Sequence[Sequence[Any]]):
+    if not metrics.TIMING:
+        await DB.executemany(query, params_list)
+        return
+    t0 = time.perf_counter()
+    await DB.executemany(query, params_list)
+    metrics.observe_query("execute_many", query, time.perf_counter() - t0)
+
+async def _write(query: str, params: Sequence[Any]) -> aiosqlite.Cursor:
     global DB
     assert DB is not None
-    async with DB.execute(query, params) as cur:
-        return await cur.fetchall()
+    if _TX_DEPTH.get():
+        return await _timed_execute(query, params)
+    async with _WRITER:
+        cur = await _timed_execute(query, params)
+        waiter = await _commit_or_join()
+    if waiter is not None:
+        await waiter
+    return cur
 
 async def execute(query: str, params: Sequence[Any] = ()) -> int:
     """Execute and return lastrowid if available, else -1"""
-    global DB
-    assert DB is not None
-    cur = await DB.execute(query, params)
-    await DB.commit()
+    cur = await _write(query, params)
     try:
         return cur.lastrowid if cur.lastrowid is not None else -1
     except Exception:
         return -1
 
+async def execute_rowcount(query: str, params: Sequence[Any] = ()) -> int:
+    """Execute and return the number of rows changed (for conditional updates)"""
+    cur = await _write(query, params)
+    return cur.rowcount
+
+async def execute_returning(query: str, params: Sequence[Any] = ()) -> Optional[Tuple[Any, ...]]:
+    """Execute a write with a RETURNING clause; first returned row, or None if nothing was written"""
+    global DB
+    assert DB is not None
+    if _TX_DEPTH.get():
+        cur = await _timed_execute(query, params)
+        rows = await cur.fetchall()
+        await cur.close()
+        return rows[0] if rows else None
+    async with _WRITER:
+        # RETURNING rows must be read before the commit
+        cur = await _timed_execute(query, params)
+        rows = await cur.fetchall()
+        await cur.close()
+        waiter = await _commit_or_join()
+    if waiter is not None:
+        await waiter
+    return rows[0] if rows else None
+
+def after_commit(callback: Callable[[], None]):
+    """Run callback once the current transaction() commits (dropped on rollback); now if outside one."""
+    pending = _ON_COMMIT.get()
+    if pending is None:
+        callback()
+    else:
+        pending.append(callback)
+
 async def execute_many(query: str, params_list: Sequence[Sequence[Any]]):
     global DB
     assert DB is not None
-    await DB.executemany(query, params_list)
-    await DB.commit()
+    if _TX_DEPTH.get():
+        await _timed_executemany(query, params_list)
+        return
+    async with _WRITER:
+        await _timed_executemany(query, params_list)
+        waiter = await _commit_or_join()
+    if waiter is not None:
+        await waiter
+
+@asynccontextmanager
+async def transaction():
+    """Run several statements atomically in one BEGIN/COMMIT.
+
+    execute/execute_many/fetch* called inside the block (from the same task)
+    join the transaction; an exception rolls the whole block back (raise
+    Rollback to do so quietly). Nested
+    transaction() blocks become savepoints. With GROUP_COMMIT_MS set the
+    final COMMIT is shared with other writers.
+    """
+    global DB
+    assert DB is not None
+    depth = _TX_DEPTH.get()
+    if depth:
+        # nested block: savepoint inside the outer transaction, no extra lock
+        name = f"sp{depth}"
+        await DB.execute(f"SAVEPOINT {name}")
+        token = _TX_DEPTH.set(depth + 1)
+        pending = _ON_COMMIT.get()
+        mark = len(pending) if pending is not None else 0
+        try:
+            yield DB
+        except BaseException as e:
+            await DB.execute(f"ROLLBACK TO {name}")
+            await DB.execute(f"RELEASE {name}")
+            if pending is not None:
+                del pending[mark:]
+            if not isinstance(e, Rollback):
+                raise
+        else:
+            await DB.execute(f"RELEASE {name}")
+        finally:
+            _TX_DEPTH.reset(token)
+        return
+    waiter = None
+    callbacks: List[Callable[[], None]] = []
+    committed = False
+    async with _WRITER:
+        if not DB.in_transaction:
+            await DB.execute("BEGIN")
+        # a savepoint keeps a rollback from discarding other writers'
+        # statements that are still waiting for a group commit
+        await DB.execute("SAVEPOINT tx")
+        token = _TX_DEPTH.set(1)
+        cb_token = _ON_COMMIT.set(callbacks)
+        try:
+            yield DB
+        except BaseException as e:
+            await DB.execute("ROLLBACK TO tx")
+            await DB.execute("RELEASE tx")
+            if _PENDING_COMMIT is None:
+                # nobody else is waiting on this transaction; end it
+                await DB.rollback()
+            if not isinstance(e, Rollback):
+                raise
+        else:
+            await DB.execute("RELEASE tx")
+            waiter = await _commit_or_join()
+            committed = True
+        finally:
+            _TX_DEPTH.reset(token)
+            _ON_COMMIT.reset(cb_token)
+    if waiter is not None:
+        await waiter
+    if committed:
+        for callback in callbacks:
+            callback()
+
+async def _commit_or_join() -> Optional[asyncio.Future]:
+    """Commit now, or (group commit mode) return the future of the next shared commit.
+
+    Must be called with _WRITE_LOCK held.
+    """
+    global _PENDING_COMMIT
+    if not GROUP_COMMIT_MS:
+        await DB.commit()
+        return None
+    if _PENDING_COMMIT is None:
+        _PENDING_COMMIT = asyncio.get_running_loop().create_future()
+        asyncio.create_task(_group_commit(_PENDING_COMMIT))
+    return _PENDING_COMMIT
+
+async def _group_commit(fut: asyncio.Future):
+    global _PENDING_COMMIT
+    await asyncio.sleep(GROUP_COMMIT_MS / 1000.0)
+    async with _WRITER:
+        _PENDING_COMMIT = None
+        try:
+            await DB.commit()
+        except Exception as e:
+            await DB.rollback()
+            fut.set_exception(e)
+        else:
+            fut.set_result(None)
+
+async def search_cards(q: str, limit: int = 50) -> List[Tuple[Any, ...]]:
+    """(id, name, file_id, file_type) of cards whose name or movie matches q, best first."""
+    terms = q.split()
+    table = 'cards_fts'
+    if FTS_TOKENIZER == 'trigram':
+        # trigram needs >= 3 chars per term; shorter ones can't narrow the match
+        long_terms = [t for t in terms if len(t) >= 3]
+        if long_terms or not FTS_SHORT:
+            terms = long_terms
+        else:
+            # only 1-2 character terms: match word prefixes instead of substrings
+            table = 'cards_fts_short'
+    if not FTS_TOKENIZER or not terms:
+        return await fetchall("SELECT id, name, file_id, file_type FROM cards WHERE name LIKE ? OR movie LIKE ? LIMIT ?",
+                              (f"{q}%", f"{q}%", limit))
+    suffix = '' if table == 'cards_fts' and FTS_TOKENIZER == 'trigram' else '*'
+    match = " ".join('"' + t.replace('"', '""') + '"' + suffix for t in terms)
+    return await fetchall(f"SELECT c.id, c.name, c.file_id, c.file_type FROM {table} f JOIN cards c ON c.id = f.rowid "
+                          f"WHERE {table} MATCH ? ORDER BY f.rank LIMIT ?", (match, limit))
@@ -0,0 +1,196 @@
+# importer.py
+# bulk card import from a directory or zip archive (+ optional CSV/JSONL manifest)
+# CLI: python importer.py <dir|zip> [--manifest FILE] [--workers N]
+import os
+import csv
+import json
+import shutil
+import asyncio
+import hashlib
+import logging
+import zipfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import db
+from db import execute_many, fetchall, transaction
+from utils import RARITY_LABEL_MAP, pick_rarity
+
+logger = logging.getLogger("catch_character_bot.importer")
+
+IMAGES_DIR = os.path.join("assets", "images")
+VIDEOS_DIR = os.path.join("assets", "videos")
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+VIDEO_EXTS = {".mp4", ".mov", ".webm", ".mkv"}
+MANIFEST_NAMES = ("manifest.csv", "manifest.jsonl")
+BATCH_SIZE = 5000
+# manifest rarity may be a key ("rare") or a label ("🔵 Rare")
+_RARITY_BY_NAME = {**{k: k for k in RARITY_LABEL_MAP}, **{lbl.lower(): k for k, lbl in RARITY_LABEL_MAP.items()}}
+
+
+class ImportResult(NamedTuple):
+    added: int
+    duplicates: int
+    failed: int
+    max_id_before: int  # MAX(cards.id) when the import started; later ids are its cards
+
+
+def _read_manifest(path: str) -> Dict[str, dict]:
+    """file -> {name, movie, rarity}; CSV needs a header row, JSONL one object per line."""
+    entries: Dict[str, dict] = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as fh:
+        if path.lower().endswith(".jsonl"):
+            rows = (json.loads(line) for line in fh if line.strip())
+        else:
+            rows = csv.DictReader(fh)
+        for row in rows:
+            f = (row.get("file") or "").strip()
+            if f:
+                entries[os.path.normpath(f)] = row
+    return entries
+
+
+def _hash(src: str) -> str:
+    """sha256 of src. Runs in a worker thread."""
+    h = hashlib.sha256()
+    with open(src, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _store(src: str, dest: str) -> str:
+    """Copy src to dest unless it is already there. Runs in a worker thread."""
+    if not os.path.exists(dest):
+        # unique temp name in the target dir, so concurrent copies never share one
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".part")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return dest
+
+
+def _extract(zip_path: str, dest: str):
+    with zipfile.ZipFile(zip_path) as zf:
+        zf.extractall(dest)
+
+
+def _collect(root: str) -> List[str]:
+    files = []
+    for dirpath, _, names in os.walk(root):
+        for n in names:
+            ext = os.path.splitext(n)[1].lower()
+            if ext in IMAGE_EXTS or ext in VIDEO_EXTS:
+                files.append(os.path.relpath(os.path.join(dirpath, n), root))
+    files.sort()
+    return files
+
+
+def _row_for(rel: str, entry: Optional[dict], digest: str, dest: str, is_video: bool, now: str) -> tuple:
+    entry = entry or {}
+    stem = os.path.splitext(os.path.basename(rel))[0]
+    name = (entry.get("name") or "").strip() or stem.replace("_", " ")
+    movie = (entry.get("movie") or "").strip() or "Unknown"
+    rarity_key = _RARITY_BY_NAME.get((entry.get("rarity") or "").strip().lower())
+    if rarity_key is None:
+        rarity_key = "animated" if is_video else pick_rarity()[0]
+    return (name, movie, RARITY_LABEL_MAP[rarity_key], rarity_key, "video" if is_video else "photo",
+            None, dest, 0, now, digest)
+
+
+async def import_cards(source: str, manifest: Optional[str] = None, workers: int = 8) -> ImportResult:
+    """Import every image/video under source (a directory or .zip) as unowned cards.
+
+    Files are hashed by a thread pool; files whose hash is already in
+    ``cards`` (or earlier in this import) are skipped, the rest are copied
+    into assets/ under their hash. Rows go in with execute_many,
+    BATCH_SIZE per transaction. file_id stays empty until media prewarm.
+    """
+    tmpdir = None
+    loop = asyncio.get_running_loop()
+    try:
+        if zipfile.is_zipfile(source):
+            tmpdir = tempfile.mkdtemp(prefix="import_")
+            await asyncio.to_thread(_extract, source, tmpdir)
+            root = tmpdir
+        else:
+            root = source
+        if manifest is None:
+            manifest = next((os.path.join(root, m) for m in MANIFEST_NAMES if os.path.exists(os.path.join(root, m))), None)
+        entries = _read_manifest(manifest) if manifest else {}
+        files = await asyncio.to_thread(_collect, root)
+        os.makedirs(IMAGES_DIR, exist_ok=True)
+        os.makedirs(VIDEOS_DIR, exist_ok=True)
+
+        known = {r[0] for r in await fetchall("SELECT content_hash FROM cards WHERE content_hash IS NOT NULL")}
+        max_id_before = (await fetchall("SELECT COALESCE(MAX(id), 0) FROM cards"))[0][0]
+        now = datetime.utcnow().isoformat()
+        added = duplicates = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(files), BATCH_SIZE):
+                chunk = files[start:start + BATCH_SIZE]
+                digests = await asyncio.gather(
+                    *[loop.run_in_executor(pool, _hash, os.path.join(root, rel)) for rel in chunk],
+                    return_exceptions=True)
+                # dedupe here, before anything is copied into assets/
+                new = []
+                for rel, digest in zip(chunk, digests):
+                    if isinstance(digest, Exception):
+                        logger.warning("import of %s failed: %s", rel, digest)
+                        failed += 1
+                    elif digest in known:
+                        duplicates += 1
+                    else:
+                        known.add(digest)
+                        ext = os.path.splitext(rel)[1].lower()
+                        dest = os.path.join(VIDEOS_DIR if ext in VIDEO_EXTS else IMAGES_DIR, digest + ext)
+                        new.append((rel, digest, dest, ext in VIDEO_EXTS))
+                stored = await asyncio.gather(
+                    *[loop.run_in_executor(pool, _store, os.path.join(root, rel), dest) for rel, _, dest, _ in new],
+                    return_exceptions=True)
+                rows = []
+                for (rel, digest, dest, is_video), res in zip(new, stored):
+                    if isinstance(res, Exception):
+                        logger.warning("import of %s failed: %s", rel, res)
+                        known.discard(digest)
+                        failed += 1
+                        continue
+                    rows.append(_row_for(rel, entries.get(os.path.normpath(rel)), digest, dest, is_video, now))
+                if rows:
+                    async with transaction():
+                        await execute_many(
+                            "INSERT INTO cards (name,movie,rarity,rarity_key,file_type,file_id,file_path,owner_id,created_at,content_hash) "
+                            "VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+                    added += len(rows)
+                logger.info("import progress: %d/%d files", start + len(chunk), len(files))
+        return ImportResult(added, duplicates, failed, max_id_before)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+async def _cli(args):
+    await db.init_db_and_dirs()
+    try:
+        result = await import_cards(args.source, args.manifest, args.workers)
+    finally:
+        await db.close_db()
+    print(f"added {result.added}, duplicates {result.duplicates}, failed {result.failed}")
+    # a running bot builds its card pool at startup; restart it (or use /import) to see these
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Bulk-import cards from a directory or zip archive")
+    parser.add_argument("source", help="directory or .zip of images/videos")
+    parser.add_argument("--manifest", help="CSV or JSONL with file,name,movie,rarity (default: manifest.csv/.jsonl in source)")
+    parser.add_argument("--workers", type=int, default=8, help="hashing/copy threads")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_cli(parser.parse_args()))
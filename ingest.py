@@ -0,0 +1,170 @@
+# ingest.py
+# background media ingest for /upload and /uploadvd: download, hash/dedup, thumbnail, resumable
+import os
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+from db import fetchone, fetchall, execute, transaction
+from outbox import OUTBOX, PRIORITY_LOW
+from locks import LOCKS
+
+logger = logging.getLogger("catch_character_bot.ingest")
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are optional
+    Image = None
+
+IMAGES_DIR = os.path.join("assets", "images")
+VIDEOS_DIR = os.path.join("assets", "videos")
+THUMBS_DIR = os.path.join("assets", "thumbs")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+# 0 disables thumbnails; they also need Pillow
+INGEST_THUMB_PROCS = int(os.getenv("INGEST_THUMB_PROCS", "1"))
+THUMB_SIZE = int(os.getenv("THUMB_SIZE", "320"))
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _make_thumbnail(src: str, dest: str, size: int) -> str:
+    """Runs in a worker process."""
+    with Image.open(src) as im:
+        im.thumbnail((size, size))
+        im.convert("RGB").save(dest + ".part", "JPEG", quality=85)
+    os.replace(dest + ".part", dest)
+    return dest
+
+
+class Ingest:
+    """Downloads uploaded media after the card row already exists.
+
+    /upload records the card (with its Telegram file_id, so it can drop at
+    once) plus an ``ingest_jobs`` row in one transaction and returns. Worker
+    tasks then fetch the file, store it under its sha256 (identical media
+    is kept once), optionally thumbnail photos in a process pool, fill in
+    cards.file_path/content_hash and delete the job. Jobs left over by a
+    restart are picked up again by ``start``.
+    """
+
+    def __init__(self):
+        self._bot = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._procs: Optional[ProcessPoolExecutor] = None
+
+    async def record(self, *, name: str, movie: str, rarity: str, rarity_key: str, file_type: str,
+                     file_id: str, chat_id: Optional[int] = None) -> int:
+        """Insert the card and its ingest job; returns the card id. Call submit() afterwards."""
+        now = datetime.utcnow().isoformat()
+        async with transaction():
+            cid = await execute("INSERT INTO cards (name,movie,rarity,rarity_key,file_type,file_id,file_path,owner_id,created_at) "
+                                "VALUES (?,?,?,?,?,?,?,?,?)", (name, movie, rarity, rarity_key, file_type, file_id, None, 0, now))
+            await execute("INSERT INTO ingest_jobs (card_id, file_id, file_type, chat_id, created_at) VALUES (?,?,?,?,?)",
+                          (cid, file_id, file_type, chat_id, now))
+        return cid
+
+    def submit(self, card_id: int):
+        if self._queue is not None:
+            self._queue.put_nowait(card_id)
+
+    def start(self, bot, workers: int = INGEST_WORKERS):
+        if self._queue is not None:
+            return
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        if Image is not None and INGEST_THUMB_PROCS > 0:
+            os.makedirs(THUMBS_DIR, exist_ok=True)
+            self._procs = ProcessPoolExecutor(max_workers=INGEST_THUMB_PROCS)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+        self._workers.append(asyncio.create_task(self._resume()))
+
+    async def _resume(self):
+        rows = await fetchall("SELECT card_id FROM ingest_jobs WHERE attempts < ? ORDER BY card_id", (INGEST_MAX_ATTEMPTS,))
+        for (cid,) in rows:
+            self.submit(cid)
+        if rows:
+            logger.info("resuming %d media downloads", len(rows))
+
+    async def stop(self):
+        """Stop the workers; unfinished jobs stay in ingest_jobs for the next start."""
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        if self._procs is not None:
+            self._procs.shutdown(wait=False, cancel_futures=True)
+            self._procs = None
+
+    async def _worker(self):
+        while True:
+            cid = await self._queue.get()
+            try:
+                await self._process(cid)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._failed(cid, e)
+            finally:
+                self._queue.task_done()
+
+    async def _failed(self, cid: int, error: Exception):
+        await execute("UPDATE ingest_jobs SET attempts = attempts + 1, last_error = ? WHERE card_id = ?", (str(error)[:500], cid))
+        row = await fetchone("SELECT attempts FROM ingest_jobs WHERE card_id = ?", (cid,))
+        attempts = row[0] if row else INGEST_MAX_ATTEMPTS
+        if attempts >= INGEST_MAX_ATTEMPTS:
+            # the card keeps working through its file_id; only the local copy is missing
+            logger.error("giving up on media for card #%d after %d attempts: %s", cid, attempts, error)
+            return
+        delay = min(300.0, 5.0 * 2 ** attempts)
+        logger.warning("media download for card #%d failed (%s), retrying in %.0fs", cid, error, delay)
+        asyncio.get_running_loop().call_later(delay, self.submit, cid)
+
+    async def _process(self, cid: int):
+        job = await fetchone("SELECT file_id, file_type, chat_id FROM ingest_jobs WHERE card_id = ?", (cid,))
+        if job is None:
+            return
+        file_id, file_type, chat_id = job
+        is_video = file_type == "video"
+        folder, ext = (VIDEOS_DIR, ".mp4") if is_video else (IMAGES_DIR, ".jpg")
+        os.makedirs(folder, exist_ok=True)
+        part = os.path.join(folder, f"ingest_{cid}{ext}.part")
+        tg_file = await self._bot.get_file(file_id)
+        await tg_file.download_to_drive(part)
+        digest = await asyncio.to_thread(_hash_file, part)
+        dest = os.path.join(folder, digest + ext)
+        if os.path.exists(dest):
+            os.remove(part)
+        else:
+            os.replace(part, dest)
+        # same-hash jobs finishing together must see each other's content_hash
+        async with LOCKS.hold(("media", digest)):
+            dup = await fetchone("SELECT id FROM cards WHERE content_hash = ? AND id != ? LIMIT 1", (digest, cid))
+            async with transaction():
+                await execute("UPDATE cards SET file_path = ?, content_hash = ? WHERE id = ?", (dest, digest, cid))
+                await execute("DELETE FROM ingest_jobs WHERE card_id = ?", (cid,))
+        if dup and chat_id:
+            OUTBOX.send(self._bot.send_message, priority=PRIORITY_LOW, chat_id=chat_id,
+                        text=f"⚠️ Card #{cid} သည် Card #{dup[0]} နှင့် ပုံ/ဗီဒီယို တူနေပါသည်။")
+        if self._procs is not None and not is_video:
+            thumb = os.path.join(THUMBS_DIR, digest + ".jpg")
+            if not os.path.exists(thumb):
+                try:
+                    await asyncio.get_running_loop().run_in_executor(self._procs, _make_thumbnail, dest, thumb, THUMB_SIZE)
+                except Exception as e:
+                    logger.warning("thumbnail for card #%d failed: %s", cid, e)
+        logger.info("stored media for card #%d at %s", cid, dest)
+
+
+INGEST = Ingest()
@@ -0,0 +1,150 @@
+# leaderboard.py
+# per-user collection aggregates kept in memory, with small always-sorted top-N boards
+import os
+import heapq
+import logging
+from bisect import insort
+from typing import Dict, List, Optional, Tuple
+
+from db import fetchall, execute, after_commit
+from utils import RARITY_LABEL_MAP, SHOP
+
+logger = logging.getLogger("catch_character_bot.leaderboard")
+
+TOP_SIZE = int(os.getenv("LEADERBOARD_SIZE", "50"))
+
+
+class TopN:
+    """Scores per user plus the k best, kept sorted as (-score, uid).
+
+    Raising a score costs O(k) at most; lowering the score of someone in the
+    top marks the board stale and the next read rebuilds it with one
+    heapq.nsmallest pass over all scores.
+    """
+
+    def __init__(self, k: int = TOP_SIZE):
+        self.k = k
+        self.scores: Dict[int, int] = {}
+        self._top: List[Tuple[int, int]] = []
+        self._members: set = set()
+        self._stale = True
+
+    def set(self, uid: int, score: int):
+        old = self.scores.get(uid, 0)
+        if score:
+            self.scores[uid] = score
+        else:
+            self.scores.pop(uid, None)
+        if self._stale or score == old:
+            return
+        if uid in self._members:
+            if score < old:
+                self._stale = True
+                return
+            self._top.remove((-old, uid))
+            insort(self._top, (-score, uid))
+            return
+        if score <= 0:
+            return
+        if len(self._top) < self.k:
+            if len(self.scores) > len(self._top) + 1:
+                # the board was trimmed earlier; someone outside may outrank this user
+                self._stale = True
+                return
+        elif (-score, uid) >= self._top[-1]:
+            return
+        insort(self._top, (-score, uid))
+        self._members.add(uid)
+        if len(self._top) > self.k:
+            self._members.discard(self._top.pop()[1])
+
+    def top(self, n: int = 10) -> List[Tuple[int, int]]:
+        """[(uid, score)] best first."""
+        if self._stale:
+            self._top = heapq.nsmallest(self.k, ((-s, u) for u, s in self.scores.items() if s > 0))
+            self._members = {u for _, u in self._top}
+            self._stale = False
+        return [(u, -s) for s, u in self._top[:n]]
+
+    def rank(self, uid: int) -> Optional[int]:
+        """1-based rank if uid is on the board."""
+        for i, (u, _) in enumerate(self.top(self.k), 1):
+            if u == uid:
+                return i
+        return None
+
+
+class Leaderboard:
+    """Per-user card counts by rarity, collection value (SHOP prices) and coins.
+
+    Loaded with one GROUP BY at startup, then moved by ``card_gained``
+    (claim/buy) and ``coins_changed`` (ledger), so /top and /stats never
+    scan ``cards``.
+    """
+
+    def __init__(self):
+        self.by_rarity: Dict[int, Dict[str, int]] = {}
+        self.names: Dict[int, str] = {}
+        self.boards: Dict[str, TopN] = {}
+        self._reset_boards()
+
+    def _reset_boards(self):
+        self.boards = {"cards": TopN(), "value": TopN(), "coins": TopN()}
+        for key in RARITY_LABEL_MAP:
+            self.boards[key] = TopN()
+
+    async def load(self):
+        self.by_rarity = {}
+        self._reset_boards()
+        rows = await fetchall("SELECT owner_id, rarity_key, COUNT(*) FROM cards WHERE owner_id != 0 "
+                              "GROUP BY owner_id, rarity_key")
+        for uid, rarity_key, n in rows:
+            self.by_rarity.setdefault(uid, {})[rarity_key or ""] = n
+        for uid in self.by_rarity:
+            self._score(uid)
+        for uid, coins, username in await fetchall("SELECT id, coins, username FROM users"):
+            self.boards["coins"].set(uid, coins or 0)
+            if username:
+                self.names.setdefault(uid, username)
+        logger.info("leaderboard loaded for %d collectors", len(self.by_rarity))
+
+    def _score(self, uid: int):
+        counts = self.by_rarity.get(uid, {})
+        self.boards["cards"].set(uid, sum(counts.values()))
+        self.boards["value"].set(uid, sum(SHOP.get(k, 0) * n for k, n in counts.items()))
+        for key, n in counts.items():
+            board = self.boards.get(key)
+            if board is not None:
+                board.set(uid, n)
+
+    def card_gained(self, uid: int, rarity_key: Optional[str], name: Optional[str] = None):
+        counts = self.by_rarity.setdefault(uid, {})
+        rarity_key = rarity_key or ""
+        counts[rarity_key] = counts.get(rarity_key, 0) + 1
+        self.boards["cards"].set(uid, self.boards["cards"].scores.get(uid, 0) + 1)
+        self.boards["value"].set(uid, self.boards["value"].scores.get(uid, 0) + SHOP.get(rarity_key, 0))
+        board = self.boards.get(rarity_key)
+        if board is not None:
+            board.set(uid, counts[rarity_key])
+        if name:
+            self.names[uid] = name
+
+    async def save_name(self, uid: int, name: Optional[str]):
+        """Remember uid's display name for /top, writing users.username only when it changed."""
+        if not name or self.names.get(uid) == name:
+            return
+        await execute("INSERT INTO users (id, username) VALUES (?, ?) "
+                      "ON CONFLICT(id) DO UPDATE SET username = excluded.username", (uid, name))
+        after_commit(lambda: self.names.__setitem__(uid, name))
+
+    def coins_changed(self, uid: int, coins: int):
+        self.boards["coins"].set(uid, coins)
+
+    def stats(self, uid: int) -> Dict[str, int]:
+        return dict(self.by_rarity.get(uid, {}))
+
+    def name_of(self, uid: int) -> str:
+        return self.names.get(uid) or f"ID {uid}"
+
+
+LEADERBOARD = Leaderboard()
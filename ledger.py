@@ -0,0 +1,105 @@
+# ledger.py
+# coin movements: one INSERT into coin_ledger per operation; balances cached write-through
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from db import fetchone, execute_returning, after_commit
+from cache import TTLCache
+
+logger = logging.getLogger("catch_character_bot.ledger")
+
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "10000"))
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "600"))
+
+# uid -> coins, set after every committed ledger write
+BALANCE_CACHE = TTLCache(maxsize=BALANCE_CACHE_SIZE, ttl=BALANCE_CACHE_TTL)
+# bumped on every write, so a read that raced a write doesn't cache the old balance
+_generation = 0
+# listener(uid, balance) after each committed change
+_LISTENERS: List[Callable[[int, int], None]] = []
+
+# the coin_ledger_apply trigger (db.py) copies balance into users.coins,
+# and for reason 'daily' the timestamp into daily.last_claim
+_INSERT = ("INSERT INTO coin_ledger (user_id, delta, reason, ref, balance, created_at) "
+           "SELECT ?1, ?2, ?3, ?4, COALESCE((SELECT coins FROM users WHERE id = ?1), 0) + ?2, ?5 "
+           "WHERE COALESCE((SELECT coins FROM users WHERE id = ?1), 0) + ?2 >= 0")
+
+
+def _remember(uid: int, balance: int):
+    global _generation
+    _generation += 1
+
+    def store():
+        global _generation
+        _generation += 1
+        BALANCE_CACHE.set(uid, balance)
+        for listener in _LISTENERS:
+            try:
+                listener(uid, balance)
+            except Exception as e:
+                logger.exception("balance listener failed: %s", e)
+    # inside transaction() this waits for the commit and is dropped on rollback
+    after_commit(store)
+
+
+def on_change(listener: Callable[[int, int], None]):
+    _LISTENERS.append(listener)
+
+
+async def apply(uid: int, delta: int, reason: str, ref=None) -> Optional[int]:
+    """Add delta (negative to spend) to uid's coins; the new balance, or None if it would go below 0.
+
+    One statement: the balance check, the ledger row and the users update
+    (via trigger) happen together, inside the caller's transaction() if any.
+    """
+    row = await execute_returning(_INSERT + " RETURNING balance",
+                                  (uid, delta, reason, None if ref is None else str(ref), datetime.utcnow().isoformat()))
+    if row is None:
+        return None
+    _remember(uid, row[0])
+    return row[0]
+
+
+async def credit(uid: int, amount: int, reason: str, ref=None) -> Optional[int]:
+    return await apply(uid, amount, reason, ref)
+
+
+async def debit(uid: int, amount: int, reason: str, ref=None) -> Optional[int]:
+    """Spend amount; None (and nothing written) if uid can't afford it."""
+    return await apply(uid, -amount, reason, ref)
+
+
+async def claim_daily(uid: int, amount: int, cooldown: timedelta) -> Optional[int]:
+    """Credit the daily reward unless uid claimed within cooldown; new balance or None.
+
+    The cooldown check and the credit are one INSERT, so two concurrent
+    /daily calls can't both pay out.
+    """
+    now = datetime.utcnow()
+    row = await execute_returning(
+        _INSERT + " AND NOT EXISTS (SELECT 1 FROM daily WHERE user_id = ?1 AND last_claim > ?6) RETURNING balance",
+        (uid, amount, "daily", None, now.isoformat(), (now - cooldown).isoformat()))
+    if row is None:
+        return None
+    _remember(uid, row[0])
+    return row[0]
+
+
+async def last_daily(uid: int) -> Optional[datetime]:
+    row = await fetchone("SELECT last_claim FROM daily WHERE user_id = ?", (uid,))
+    return datetime.fromisoformat(row[0]) if row else None
+
+
+async def balance(uid: int) -> int:
+    coins = BALANCE_CACHE.get(uid)
+    if coins is not None:
+        return coins
+    generation = _generation
+    row = await fetchone("SELECT coins FROM users WHERE id = ?", (uid,))
+    coins = row[0] if row else 0
+    if generation == _generation:
+        BALANCE_CACHE.set(uid, coins)
+    return coins
+
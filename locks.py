@@ -0,0 +1,53 @@
+# locks.py
+# keyed asyncio locks: one lock per chat / user / card, created on demand, dropped when idle
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+
+
+class KeyedLocks:
+    """An asyncio.Lock per key, reference counted.
+
+    A key's lock exists only while some task holds it or waits for it, so the
+    table stays as small as the number of keys in use right now. ``hold``
+    takes several keys in sorted order, so two tasks locking overlapping key
+    sets can't deadlock.
+    """
+
+    def __init__(self):
+        # key -> [lock, holders + waiters]
+        self._locks: Dict[Hashable, List] = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    @asynccontextmanager
+    async def hold(self, *keys: Hashable):
+        entries = []
+        for key in sorted(set(keys)):
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            entries.append((key, entry))
+        acquired = 0
+        try:
+            for _, entry in entries:
+                await entry[0].acquire()
+                acquired += 1
+            yield
+        finally:
+            for _, entry in entries[:acquired]:
+                entry[0].release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+# keys are tuples: ("chat", chat_id), ("user", uid), ("card", card_id), ("media", sha256)
+LOCKS = KeyedLocks()
@@ -1,51 +1,141 @@
 
-## part1_main.py
-# part1_main.py
+# main.py
 # -*- coding: utf-8 -*-
 """
-Main entry for Catch Character Bot (optimized, split in 3 parts)
-Run: python3 part1_main.py
+Main entry for Catch Character Bot
+Run: python3 main.py
 """
+# first, so the startup report includes the time spent importing everything below
+from startup import STARTUP
 import os
+import signal
 import asyncio
 import logging
+import shutil
 import tempfile
-import zipfile
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile)
+# before the local imports: db, outbox, metrics, webhook read their settings at import time
+load_dotenv()
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile,
+                      InlineQueryResultCachedPhoto, InlineQueryResultArticle, InputTextMessageContent)
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
     InlineQueryHandler, ContextTypes, filters
 )
 
 # local modules
-from part2_db import DB, init_db_and_dirs, close_db, fetchone, fetchall, execute, execute_many
-from part3_utils import (
+from db import (DB_FILE, init_db_and_dirs, close_db, fetchone, fetchall,
+                execute_rowcount, transaction, Rollback, search_cards)
+from counters import COUNTERS
+from cardpool import POOL
+from cache import TTLCache
+from backup import create_backup
+from authz import AUTHZ
+from settings import SETTINGS
+from outbox import OUTBOX, PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_BULK
+from media import send_card, prewarm_loop, RECENT_FILE_IDS
+from importer import import_cards
+from locks import LOCKS
+from sampler import RaritySampler
+import ledger
+from leaderboard import LEADERBOARD
+from ingest import INGEST
+from metrics import (METRICS, METRICS_ENABLED, METRICS_PORT, METRICS_LOG_INTERVAL, TimedRequest, timed_handler,
+                     serve as serve_metrics, log_loop as metrics_log_loop)
+from utils import (
     owner_only, admin_or_owner, user_allowed, extract_target_user,
-    pick_rarity, ITEM_LIST, SHOP, RARITY_LABEL_MAP, shop_keyboard_for
+    pick_rarity, ITEM_LIST, SHOP, RARITY_LEVELS, RARITY_WEIGHTS, RARITY_LABEL_MAP, shop_keyboard_for, harem_keyboard_for
 )
 
 # load env
-load_dotenv()
 TOKEN = os.getenv("TOKEN")
 OWNER_ID = int(os.getenv("OWNER_ID" or "0"))
 BACKUP_CHAT = os.getenv("BACKUP_CHAT_ID")
 DROP_NUMBER_DEFAULT = int(os.getenv("DROP_NUMBER", "10"))
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "30"))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "2048"))
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "60"))
+HAREM_PAGE_SIZE = int(os.getenv("HAREM_PAGE_SIZE", "20"))
+# chat that receives (and immediately loses) warm-up uploads for cards without a file_id
+MEDIA_PREWARM_CHAT = os.getenv("MEDIA_PREWARM_CHAT") or BACKUP_CHAT
+MEDIA_PREWARM_INTERVAL = float(os.getenv("MEDIA_PREWARM_INTERVAL", "3600"))
+# "polling" or "webhook" (see webhook.py for WEBHOOK_* settings)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# updates handled at the same time (1 = strictly sequential)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# seconds to wait for in-flight updates on shutdown
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
 
 # assets
 ASSETS_DIR = "assets"
 IMAGES_DIR = os.path.join(ASSETS_DIR, "images")
 VIDEOS_DIR = os.path.join(ASSETS_DIR, "videos")
 BACKUP_DIR = "backups"
+# bots can't send documents larger than this
+BOT_UPLOAD_LIMIT = 50 * 1024 * 1024
 
 # logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("catch_character_bot")
 
-# runtime locks
-DB_LOCK = asyncio.Lock()
-DROP_LOCKS = {}
+# normalized inline query -> built InlineQueryResult list
+INLINE_CACHE = TTLCache(maxsize=INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL)
+
+# drop rarity by RARITY_WEIGHTS, over rarities that still have unowned cards
+DROP_SAMPLER = RaritySampler({k: w for (k, _), w in zip(RARITY_LEVELS, RARITY_WEIGHTS)})
+POOL.on_rarity_change(DROP_SAMPLER.set_available)
+ledger.on_change(LEADERBOARD.coins_changed)
+
+def _card_added(cid: int, rarity_key: str):
+    """Keep in-memory views in sync after a new card row is inserted."""
+    POOL.add(cid, rarity_key)
+    INLINE_CACHE.clear()
+
+def _edit_query_message(query, text: str, **kwargs):
+    """Queue an edit of the message behind a callback query (urgent lane, coalesced per message)."""
+    msg = query.message
+    if msg is None:
+        return OUTBOX.send(query.edit_message_text, priority=PRIORITY_URGENT,
+                           coalesce_key=("edit", query.inline_message_id), text=text, **kwargs)
+    # drops are photos/videos, so their text lives in the caption
+    func = query.edit_message_caption if (msg.photo or msg.video) else query.edit_message_text
+    field = "caption" if (msg.photo or msg.video) else "text"
+    return OUTBOX.send(func, chat=msg.chat_id, priority=PRIORITY_URGENT,
+                       coalesce_key=("edit", msg.chat_id, msg.message_id), **{field: text}, **kwargs)
+
+async def _send_document_file(bot, chat_id: int, path: str):
+    # opened per attempt so a retry re-reads the file from the start
+    with open(path, "rb") as fh:
+        return await bot.send_document(chat_id=chat_id, document=InputFile(fh, filename=os.path.basename(path)))
+
+async def _pick_unowned(columns: str, rarity_key=None):
+    """Pick a random unowned card from POOL and return its row (or None)."""
+    for _ in range(5):
+        cid = POOL.pick(rarity_key)
+        if cid is None:
+            return None
+        row = await fetchone(f"SELECT {columns} FROM cards WHERE id = ? AND owner_id = 0", (cid,))
+        if row:
+            return row
+        # stale pool entry (owned or deleted meanwhile)
+        POOL.remove(cid)
+    return None
+
+async def _take_unowned(uid: int, rarity_key: str):
+    """Give uid a random unowned card of rarity_key; return its id or None.
+
+    Ownership is flipped with a conditional UPDATE, so a concurrent claim of
+    the same card simply makes this one try the next candidate.
+    """
+    for _ in range(5):
+        cid = POOL.pick(rarity_key)
+        if cid is None:
+            return None
+        if await execute_rowcount("UPDATE cards SET owner_id = ? WHERE id = ? AND owner_id = 0", (uid, cid)):
+            return cid
+        POOL.remove(cid)
+    return None
 
 # ---------------- handlers ----------------
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -58,17 +148,16 @@ async def cmd_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("📷 ဓာတ်ပုံတစ်ပုံကို /upload နဲ့ အတူပေးပို့ပါ (caption: name|movie optional).")
         return
     photo = update.message.photo[-1]
-    f = await photo.get_file()
-    os.makedirs(IMAGES_DIR, exist_ok=True)
-    local_path = os.path.join(IMAGES_DIR, f"{photo.file_id}.jpg")
-    await f.download_to_drive(local_path)
     caption = update.message.caption or ""
     parts = [p.strip() for p in caption.split("|")]
     name = parts[0] if parts and parts[0] else f"Card-{photo.file_unique_id[:6]}"
     movie = parts[1] if len(parts) > 1 else "Unknown"
     rarity_key, rarity_label = pick_rarity()
-    cid = await execute("INSERT INTO cards (name,movie,rarity,rarity_key,file_type,file_id,file_path,owner_id,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
-                        (name, movie, rarity_label, rarity_key, 'photo', photo.file_id, local_path, 0, datetime.utcnow().isoformat()))
+    # the card is live right away through its file_id; INGEST downloads the file in the background
+    cid = await INGEST.record(name=name, movie=movie, rarity=rarity_label, rarity_key=rarity_key,
+                              file_type='photo', file_id=photo.file_id, chat_id=update.effective_chat.id)
+    INGEST.submit(cid)
+    _card_added(cid, rarity_key)
     await update.message.reply_text(f"✅ Image uploaded as card #{cid} — {rarity_label}")
 
 @admin_or_owner
@@ -77,65 +166,217 @@ async def cmd_uploadvd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🎬 ဗီဒီယိုကို /uploadvd နဲ့ အတူပေးပို့ပါ (caption: name|movie optional).")
         return
     video = update.message.video
-    f = await video.get_file()
-    os.makedirs(VIDEOS_DIR, exist_ok=True)
-    local_path = os.path.join(VIDEOS_DIR, f"{video.file_id}.mp4")
-    await f.download_to_drive(local_path)
     caption = update.message.caption or ""
     parts = [p.strip() for p in caption.split("|")]
     name = parts[0] if parts and parts[0] else f"VideoCard-{video.file_unique_id[:6]}"
     movie = parts[1] if len(parts) > 1 else "Unknown"
     rarity_key = "animated"
     rarity_label = RARITY_LABEL_MAP[rarity_key]
-    cid = await execute("INSERT INTO cards (name,movie,rarity,rarity_key,file_type,file_id,file_path,owner_id,created_at) VALUES (?,?,?,?,?,?,?,?,?)",
-                        (name, movie, rarity_label, rarity_key, 'video', video.file_id, local_path, 0, datetime.utcnow().isoformat()))
+    cid = await INGEST.record(name=name, movie=movie, rarity=rarity_label, rarity_key=rarity_key,
+                              file_type='video', file_id=video.file_id, chat_id=update.effective_chat.id)
+    INGEST.submit(cid)
+    _card_added(cid, rarity_key)
     await update.message.reply_text(f"✅ Video uploaded as card #{cid} — {rarity_label}")
 
 @admin_or_owner
 async def cmd_setdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if len(context.args) != 1:
-        await update.message.reply_text("အသုံး: /setdrop <number>")
+    args = context.args or []
+    here = len(args) == 2 and args[1].lower() == "here"
+    if len(args) not in (1, 2) or (len(args) == 2 and not here):
+        await update.message.reply_text("အသုံး: /setdrop <number|reset> [here]")
+        return
+    chat_id = None
+    if here:
+        if update.effective_chat.type not in ("group", "supergroup"):
+            await update.message.reply_text("❌ 'here' ကို group ထဲမှာပဲ သုံးနိုင်ပါတယ်")
+            return
+        chat_id = update.effective_chat.id
+    if args[0].lower() == "reset":
+        await SETTINGS.unset("drop_number", chat_id=chat_id)
+        n = SETTINGS.get_int("drop_number", DROP_NUMBER_DEFAULT, chat_id=chat_id)
+        await update.message.reply_text(f"✅ Drop number ကို default ({n}) ပြန်ထားလိုက်သည်။")
         return
     try:
-        n = int(context.args[0])
+        n = int(args[0])
+        if n < 1:
+            raise ValueError(n)
     except Exception:
         await update.message.reply_text("❌ နံပါတ် မမှန်ပါ")
         return
-    # store in settings
-    await execute("INSERT OR REPLACE INTO settings (key,value) VALUES (?,?)", ("drop_number", str(n)))
-    await update.message.reply_text(f"✅ Drop number ကို {n} အဖြစ် သတ်မှတ်လိုက်သည်။")
+    # persisted to settings / chat_settings and swapped into SETTINGS in memory
+    await SETTINGS.set("drop_number", n, chat_id=chat_id)
+    scope = " (ဒီ group အတွက်)" if chat_id is not None else ""
+    await update.message.reply_text(f"✅ Drop number ကို {n} အဖြစ် သတ်မှတ်လိုက်သည်။{scope}")
 
 @admin_or_owner
 async def cmd_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    full = bool(context.args) and context.args[0].lower() == "full"
     await update.message.reply_text("🔁 Backup လုပ်နေပါတယ်...")
-    with tempfile.TemporaryDirectory() as tmpdir:
-        zip_path = os.path.join(tmpdir, f"catch_backup_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.zip")
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            if os.path.exists(DB.DB_FILE):
-                zf.write(DB.DB_FILE, arcname=os.path.basename(DB.DB_FILE))
-            for root, _, files in os.walk(ASSETS_DIR):
-                for f in files:
-                    full = os.path.join(root, f)
-                    arc = os.path.relpath(full, start=ASSETS_DIR)
-                    zf.write(full, arcname=os.path.join("assets", arc))
-        target = int(BACKUP_CHAT) if BACKUP_CHAT and BACKUP_CHAT.isdigit() else update.effective_user.id
-        try:
-            await context.bot.send_document(chat_id=target, document=InputFile(zip_path))
-            await update.message.reply_text("✅ Backup ပေးပို့်ပြီးပါပြီ။")
-        except Exception as e:
-            logger.exception("backup failed: %s", e)
-            await update.message.reply_text(f"❌ Backup ပို့မရပါ: {e}")
+    try:
+        result = await create_backup(DB_FILE, full=full)
+    except Exception as e:
+        logger.exception("backup failed: %s", e)
+        await update.message.reply_text(f"❌ Backup မလုပ်နိုင်ပါ: {e}")
+        return
+    if result.size > BOT_UPLOAD_LIMIT:
+        await update.message.reply_text(f"⚠️ Backup က Telegram upload limit ထက်ကြီးနေပါတယ် — server ပေါ်မှာ {result.path} အဖြစ် သိမ်းထားပါတယ်။")
+        return
+    target = int(BACKUP_CHAT) if BACKUP_CHAT and BACKUP_CHAT.lstrip("-").isdigit() else update.effective_user.id
+    sent = await OUTBOX.send(_send_document_file, priority=PRIORITY_BULK, bot=context.bot, chat_id=target, path=result.path)
+    if sent:
+        await update.message.reply_text(f"✅ Backup ပေးပို့်ပြီးပါပြီ။ (assets အသစ် {result.assets_added} ခု)")
+    else:
+        await update.message.reply_text(f"❌ Backup ပို့မရပါ — server ပေါ်မှာ {result.path} အဖြစ် သိမ်းထားပါတယ်။")
+
+async def _set_authz(update: Update, context: ContextTypes.DEFAULT_TYPE, table: str, on: bool, done: str):
+    target = await extract_target_user(update, context)
+    if not target:
+        await update.message.reply_text("အသုံး: reply ပြန်ပြီး (သို့) /<command> <user_id|@username>")
+        return
+    if on and target.id == OWNER_ID:
+        await update.message.reply_text("❌ Owner ကို မလုပ်နိုင်ပါ")
+        return
+    if on:
+        await AUTHZ.add(table, target.id)
+    else:
+        await AUTHZ.remove(table, target.id)
+    await update.message.reply_text(f"✅ {target.id} {done}")
+
+@admin_or_owner
+async def cmd_ban(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _set_authz(update, context, "banned", True, "ကို ban လိုက်ပါပြီ။")
+
+@admin_or_owner
+async def cmd_unban(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _set_authz(update, context, "banned", False, "ကို unban လိုက်ပါပြီ။")
+
+@admin_or_owner
+async def cmd_mute(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _set_authz(update, context, "muted", True, "ကို mute လိုက်ပါပြီ။")
+
+@admin_or_owner
+async def cmd_unmute(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _set_authz(update, context, "muted", False, "ကို unmute လိုက်ပါပြီ။")
+
+@owner_only
+async def cmd_addsudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _set_authz(update, context, "sudo", True, "ကို sudo ပေးလိုက်ပါပြီ။")
+
+@owner_only
+async def cmd_rmsudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _set_authz(update, context, "sudo", False, "ရဲ့ sudo ကို ဖြုတ်လိုက်ပါပြီ။")
+
+@admin_or_owner
+async def cmd_cardstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Available / owned cards per rarity, from the in-memory pool counters."""
+    counts = POOL.counts()
+    lines = ["📊 Card stats (available / owned)"]
+    for key, label in RARITY_LABEL_MAP.items():
+        avail, owned = counts.pop(key, (0, 0))
+        lines.append(f"{label}: {avail} / {owned}")
+    for key, (avail, owned) in counts.items():
+        lines.append(f"{key or '(none)'}: {avail} / {owned}")
+    lines.append(f"\nစုစုပေါင်း: {POOL.available()} / {POOL.owned()}")
+    await update.message.reply_text("\n".join(lines))
+
+@owner_only
+async def cmd_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/import <server dir|zip> [manifest], or /import as the caption of a .zip document."""
+    doc = update.message.document if update.message else None
+    if not context.args and not doc:
+        await update.message.reply_text("အသုံး: /import <dir|zip path> [manifest.csv|jsonl] (သို့) .zip ဖိုင်ကို caption /import နဲ့ ပို့ပါ")
+        return
+    await update.message.reply_text("📦 Import လုပ်နေပါတယ်...")
+    tmpdir = None
+    # batches commit as they go, so even a failed import may have added cards
+    max_id_before = (await fetchone("SELECT COALESCE(MAX(id), 0) FROM cards"))[0]
+    try:
+        if doc:
+            tmpdir = tempfile.mkdtemp(prefix="import_dl_")
+            source = os.path.join(tmpdir, os.path.basename(doc.file_name or "import.zip"))
+            await (await doc.get_file()).download_to_drive(source)
+            manifest = None
+        else:
+            source = context.args[0]
+            manifest = context.args[1] if len(context.args) > 1 else None
+        result = await import_cards(source, manifest)
+    except Exception as e:
+        logger.exception("import failed: %s", e)
+        await update.message.reply_text(f"❌ Import မအောင်မြင်ပါ: {e}")
+        return
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        for cid, rarity_key in await fetchall("SELECT id, rarity_key FROM cards WHERE id > ? AND owner_id = 0", (max_id_before,)):
+            _card_added(cid, rarity_key)
+    await update.message.reply_text(f"✅ Import ပြီးပါပြီ — အသစ် {result.added}, ထပ်နေသော {result.duplicates}, မအောင်မြင် {result.failed}")
 
 # --- user commands ---
+async def _harem_page(uid: int, rarity_key, direction: str, cursor: int):
+    """One keyset page of uid's cards: (rows, has_prev, has_next). Never reads more than a page + 1 rows."""
+    where = "owner_id = ?"
+    params = [uid]
+    if rarity_key:
+        where += " AND rarity_key = ?"
+        params.append(rarity_key)
+    if direction == "p":
+        rows = await fetchall(f"SELECT id, name, rarity FROM cards WHERE {where} AND id < ? ORDER BY id DESC LIMIT ?",
+                              (*params, cursor, HAREM_PAGE_SIZE + 1))
+        has_prev = len(rows) > HAREM_PAGE_SIZE
+        rows = rows[:HAREM_PAGE_SIZE][::-1]
+        if rows:
+            return rows, has_prev, True
+        # nothing before the cursor any more: show the first page instead
+        cursor = 0
+    rows = await fetchall(f"SELECT id, name, rarity FROM cards WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+                          (*params, cursor, HAREM_PAGE_SIZE + 1))
+    has_next = len(rows) > HAREM_PAGE_SIZE
+    return rows[:HAREM_PAGE_SIZE], cursor > 0, has_next
+
+def _harem_text(rarity_key, rows):
+    title = "🌟 ကိုယ့်ကဒ်များ"
+    if rarity_key:
+        title += f" ({RARITY_LABEL_MAP.get(rarity_key, rarity_key)})"
+    if not rows:
+        return title + ":\n🗃️ ဒီ rarity မှာ card မရှိသေးပါ။"
+    return title + ":\n" + "\n".join([f"#{r[0]} — {r[2]}: {r[1][:64]}" for r in rows])
+
 @user_allowed
 async def cmd_harem(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    rows = await fetchall("SELECT id, name, rarity FROM cards WHERE owner_id = ?", (user.id,))
-    if not rows:
+    rarity_key = context.args[0].lower() if context.args else None
+    if rarity_key and rarity_key not in RARITY_LABEL_MAP:
+        await update.message.reply_text("အသုံး: /harem [" + "|".join(RARITY_LABEL_MAP) + "]")
+        return
+    rows, has_prev, has_next = await _harem_page(user.id, rarity_key, "n", 0)
+    if not rows and not rarity_key:
         await update.message.reply_text("🗃️ ကိုယ့်မှာ card မရှိသေးပါ။")
         return
-    text = "🌟 ကိုယ့်ကဒ်များ:\n" + "\n".join([f"#{r[0]} — {r[2]}: {r[1]}" for r in rows])
-    await update.message.reply_text(text)
+    first_id, last_id = (rows[0][0], rows[-1][0]) if rows else (0, 0)
+    await update.message.reply_text(_harem_text(rarity_key, rows),
+                                    reply_markup=harem_keyboard_for(user.id, rarity_key, first_id, last_id, has_prev, has_next))
+
+@user_allowed
+async def cb_harem(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    parts = (query.data or "").split(":")
+    try:
+        uid, rk, direction, cursor = int(parts[1]), parts[2], parts[3], int(parts[4])
+    except Exception:
+        await query.answer()
+        return
+    if query.from_user.id != uid:
+        await query.answer("ဒါ သင့် harem မဟုတ်ပါ", show_alert=True)
+        return
+    await query.answer()
+    rarity_key = None if rk == "all" else rk
+    rows, has_prev, has_next = await _harem_page(uid, rarity_key, direction, cursor)
+    first_id, last_id = (rows[0][0], rows[-1][0]) if rows else (0, 0)
+    try:
+        await query.edit_message_text(_harem_text(rarity_key, rows),
+                                      reply_markup=harem_keyboard_for(uid, rarity_key, first_id, last_id, has_prev, has_next))
+    except Exception:
+        pass
 
 @user_allowed
 async def cmd_see(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -156,16 +397,9 @@ async def cmd_see(update: Update, context: ContextTypes.DEFAULT_TYPE):
     file_id = card[6]
     file_path = card[7]
     try:
-        if ftype == "photo":
-            if file_id:
-                await update.message.reply_photo(photo=file_id, caption=text)
-            else:
-                await update.message.reply_photo(photo=open(file_path, "rb"), caption=text)
-        elif ftype == "video":
-            if file_id:
-                await update.message.reply_video(video=file_id, caption=text)
-            else:
-                await update.message.reply_video(video=open(file_path, "rb"), caption=text)
+        if ftype in ("photo", "video"):
+            await send_card(update.message.reply_photo, update.message.reply_video,
+                            card[0], ftype, file_id, file_path, caption=text)
         else:
             await update.message.reply_text(text)
     except Exception:
@@ -174,53 +408,85 @@ async def cmd_see(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @user_allowed
 async def cmd_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    row = await fetchone("SELECT coins FROM users WHERE id = ?", (uid,))
-    coins = row[0] if row else 0
+    coins = await ledger.balance(uid)
     await update.message.reply_text(f"💰 သင့် Coin: {coins}")
 
 @user_allowed
 async def cmd_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    now = datetime.utcnow()
-    r = await fetchone("SELECT last_claim FROM daily WHERE user_id = ?", (uid,))
-    if r:
-        last = datetime.fromisoformat(r[0])
-        if now - last < timedelta(hours=24):
-            remain = timedelta(hours=24) - (now - last)
-            hours = remain.seconds // 3600
-            minutes = (remain.seconds % 3600) // 60
-            await update.message.reply_text(f"⏳ နောက် {hours} နာရီ {minutes} မိနစ်ကြာမှ ပြန်ယူနိုင်ပါမယ်")
-            return
-    await execute("INSERT OR REPLACE INTO daily (user_id, last_claim) VALUES (?,?)", (uid, now.isoformat()))
-    await execute("INSERT OR REPLACE INTO users (id, coins) VALUES (?, COALESCE((SELECT coins FROM users WHERE id = ?), 0) + 50)", (uid, uid))
+    # cooldown check + credit + daily.last_claim in one statement
+    if await ledger.claim_daily(uid, 50, timedelta(hours=24)) is None:
+        last = await ledger.last_daily(uid) or datetime.utcnow()
+        remain = max(timedelta(0), timedelta(hours=24) - (datetime.utcnow() - last))
+        hours = remain.seconds // 3600
+        minutes = (remain.seconds % 3600) // 60
+        await update.message.reply_text(f"⏳ နောက် {hours} နာရီ {minutes} မိနစ်ကြာမှ ပြန်ယူနိုင်ပါမယ်")
+        return
     await update.message.reply_text("🎁 Daily +50 coins ရယူပြီးပါပြီ!")
 
+# --- leaderboards ---
+TOP_TITLES = {"cards": "🃏 Top collectors", "value": "💎 Top collection value", "coins": "💰 Top coins"}
+
+@user_allowed
+async def cmd_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    key = context.args[0].lower() if context.args else "cards"
+    board = LEADERBOARD.boards.get(key)
+    if board is None:
+        await update.message.reply_text("အသုံး: /top [cards|value|coins|" + "|".join(RARITY_LABEL_MAP) + "]")
+        return
+    rows = board.top(10)
+    title = TOP_TITLES.get(key) or f"🏆 Top {RARITY_LABEL_MAP[key]} holders"
+    if not rows:
+        await update.message.reply_text(f"{title}\n\nမရှိသေးပါ။")
+        return
+    lines = [f"{i}. {LEADERBOARD.name_of(uid)} — {score}" for i, (uid, score) in enumerate(rows, 1)]
+    await update.message.reply_text(title + "\n\n" + "\n".join(lines))
+
+@user_allowed
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    await LEADERBOARD.save_name(user.id, user.full_name)
+    counts = LEADERBOARD.stats(user.id)
+    lines = [f"📊 {user.full_name} ၏ collection"]
+    for key, label in RARITY_LABEL_MAP.items():
+        if counts.get(key):
+            lines.append(f"{label}: {counts[key]}")
+    total = LEADERBOARD.boards["cards"].scores.get(user.id, 0)
+    value = LEADERBOARD.boards["value"].scores.get(user.id, 0)
+    lines.append(f"\nကဒ်စုစုပေါင်း: {total}\nတန်ဖိုး: {value} coins\nCoins: {await ledger.balance(user.id)}")
+    for key in ("cards", "value"):
+        rank = LEADERBOARD.boards[key].rank(user.id)
+        if rank:
+            lines.append(f"{TOP_TITLES[key]}: #{rank}")
+    await update.message.reply_text("\n".join(lines))
+
 # --- shop callbacks ---
+def _shop_text(page: int) -> str:
+    key, label, price = ITEM_LIST[page]
+    # available count comes from POOL, no table scan per page flip
+    return f"🛒 Shop\n\n{label}\nဈေးနှုန်း: {price} coins\nAvailable: {POOL.available(key)} ကဒ်\n\nBuy ကိုနှိပ်ပါ။"
+
+@user_allowed
 async def cmd_shop_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     page = 0
-    key, label, price = ITEM_LIST[page]
-    # count available
-    row = await fetchone("SELECT COUNT(*) FROM cards WHERE rarity_key = ? AND owner_id = 0", (key,))
-    avail = row[0] if row else 0
-    text = f"🛒 Shop\n\n{label}\nဈေးနှုန်း: {price} coins\nAvailable: {avail} ကဒ်\n\nBuy ကိုနှိပ်ပါ။"
-    await update.message.reply_text(text, reply_markup=shop_keyboard_for(page))
+    await update.message.reply_text(_shop_text(page), reply_markup=shop_keyboard_for(page))
 
+@user_allowed
 async def cb_shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     data = query.data or ""
+    # one answer per callback query: plain on success, an alert on each failure
     if data == "shop:close":
+        await query.answer()
         try:
             await query.edit_message_reply_markup(reply_markup=None)
         except Exception:
             pass
         return
     if data.startswith("shop:page:"):
+        await query.answer()
         page = int(data.split(":")[2]) % len(ITEM_LIST)
-        key, label, price = ITEM_LIST[page]
-        row = await fetchone("SELECT COUNT(*) FROM cards WHERE rarity_key = ? AND owner_id = 0", (key,))
-        avail = row[0] if row else 0
-        text = f"🛒 Shop\n\n{label}\nဈေးနှုန်း: {price} coins\nAvailable: {avail} ကဒ်\n\nBuy ကိုနှိပ်ပါ။"
+        text = _shop_text(page)
         try:
             await query.edit_message_text(text, reply_markup=shop_keyboard_for(page))
         except Exception:
@@ -234,55 +500,63 @@ async def cb_shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if price is None:
             await query.answer("Invalid item", show_alert=True)
             return
-        async with DB_LOCK:
-            # pick a random unowned card
-            row = await fetchone("SELECT id FROM cards WHERE rarity_key = ? AND owner_id = 0 ORDER BY RANDOM() LIMIT 1", (rarity_key,))
-            if not row:
-                await query.answer("❌ ဒီ rarity က အသင့်ရရှိနိုင်တဲ့ ကဒ် မရှိပါ", show_alert=True)
-                return
-            cid = row[0]
-            r = await fetchone("SELECT coins FROM users WHERE id = ?", (uid,))
-            curcoins = r[0] if r else 0
-            if curcoins < price:
-                await query.answer("❌ Coins မလုံလောက်ပါ", show_alert=True)
-                return
-            newcoins = curcoins - price
-            if r:
-                await execute("UPDATE users SET coins = ? WHERE id = ?", (newcoins, uid))
-            else:
-                await execute("INSERT INTO users (id, coins) VALUES (?,?)", (uid, newcoins))
-            await execute("UPDATE cards SET owner_id = ? WHERE id = ?", (uid, cid))
-        new_coins = (await fetchone("SELECT coins FROM users WHERE id = ?", (uid,)))[0]
+        if not POOL.available(rarity_key):
+            await query.answer("❌ ဒီ rarity က အသင့်ရရှိနိုင်တဲ့ ကဒ် မရှိပါ", show_alert=True)
+            return
+        cid = None
+        # one purchase per user at a time (double taps); no card lock here --
+        # claimers take a card lock before the write lock, we already hold the latter
+        async with LOCKS.hold(("user", uid)):
+            async with transaction():
+                # writes nothing and returns None if the balance doesn't cover the price
+                new_coins = await ledger.debit(uid, price, "buy", ref=rarity_key)
+                debited = new_coins is not None
+                if debited:
+                    cid = await _take_unowned(uid, rarity_key)
+                    if cid is None:
+                        # sold out meanwhile: undo the debit
+                        raise Rollback()
+                    await LEADERBOARD.save_name(uid, query.from_user.full_name)
+            if cid is not None:
+                POOL.remove(cid)
+                LEADERBOARD.card_gained(uid, rarity_key, query.from_user.full_name)
+        if not debited:
+            await query.answer("❌ Coins မလုံလောက်ပါ", show_alert=True)
+            return
+        if cid is None:
+            await query.answer("❌ ဒီ rarity က အသင့်ရရှိနိုင်တဲ့ ကဒ် မရှိပါ", show_alert=True)
+            return
+        await query.answer()
         text = f"✅ သင်ဝယ်ပြီးဖြစ်သည် — Card #{cid} ({RARITY_LABEL_MAP.get(rarity_key, rarity_key)})\nကျန်ရှိ Coins: {new_coins}\n\n/see {cid} ဖြင့် ကြည့်ပါ"
-        try:
-            await query.edit_message_text(text)
-        except Exception:
-            await query.message.reply_text(text)
-        try:
-            await context.bot.send_message(chat_id=uid, text=f"🎉 ဝယ်ယူပြီး — Card #{cid} ({RARITY_LABEL_MAP.get(rarity_key, rarity_key)})")
-        except Exception:
-            pass
+        _edit_query_message(query, text)
+        OUTBOX.send(context.bot.send_message, priority=PRIORITY_LOW, chat_id=uid,
+                    text=f"🎉 ဝယ်ယူပြီး — Card #{cid} ({RARITY_LABEL_MAP.get(rarity_key, rarity_key)})")
         return
+    await query.answer()
 
 # --- inline search ---
-async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = (update.inline_query.query or "").strip().lower()
-    results = []
+async def _build_inline_results(q: str):
     if not q:
         rows = await fetchall("SELECT id, name, file_id, file_type FROM cards ORDER BY id DESC LIMIT 10")
     else:
-        rows = await fetchall("SELECT id, name, file_id, file_type FROM cards WHERE LOWER(name) LIKE ? LIMIT 50", (f"%{q}%",))
-    for r in rows[:50]:
-        cid, name, file_id, ftype = r
+        rows = await search_cards(q, 50)
+    results = []
+    for cid, name, file_id, ftype in rows[:50]:
         if ftype == "photo" and file_id:
-            from telegram import InlineQueryResultCachedPhoto
             results.append(InlineQueryResultCachedPhoto(
                 id=str(cid), photo_file_id=file_id, title=f"{name} (#{cid})", description=f"See with /see {cid}"
             ))
         else:
-            from telegram import InlineQueryResultArticle, InputTextMessageContent
             results.append(InlineQueryResultArticle(id=f"art{cid}", title=f"{name} (#{cid})",
                                                      input_message_content=InputTextMessageContent(f"{name} — use /see {cid} to view")))
+    return results
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = " ".join((update.inline_query.query or "").lower().split())
+    results = INLINE_CACHE.get(q)
+    if results is None:
+        results = await _build_inline_results(q)
+        INLINE_CACHE.set(q, results)
     try:
         await update.inline_query.answer(results[:50], cache_time=15)
     except Exception:
@@ -295,94 +569,113 @@ async def on_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user and update.effective_user.is_bot:
         return
     user = update.effective_user
-    # banned check
-    if await fetchone("SELECT 1 FROM banned WHERE id = ?", (user.id,)):
+    # banned check (in-memory)
+    if AUTHZ.is_banned(user.id):
         try:
             await update.message.reply_text("🔒 သင့်ကို global ban ထားပါသည်။")
         except Exception:
             pass
         return
+    # muted users' messages don't count towards drops
+    if AUTHZ.is_muted(user.id):
+        return
     chat_id = update.effective_chat.id
-    # ensure group record
-    await execute("INSERT OR IGNORE INTO groups_seen (chat_id, messages_count, last_drop_card_id) VALUES (?,?,?)", (chat_id, 0, 0))
-    await execute("UPDATE groups_seen SET messages_count = messages_count + 1 WHERE chat_id = ?", (chat_id,))
-    row = await fetchone("SELECT messages_count FROM groups_seen WHERE chat_id = ?", (chat_id,))
-    count = row[0] if row else 0
-    r = await fetchone("SELECT value FROM settings WHERE key = ?", ("drop_number",))
-    drop_n = int(r[0]) if r else DROP_NUMBER_DEFAULT
-    if count >= drop_n:
-        await execute("UPDATE groups_seen SET messages_count = 0 WHERE chat_id = ?", (chat_id,))
-        # debounce
-        now_ts = datetime.utcnow().timestamp()
-        last_ts = DROP_LOCKS.get(chat_id, 0)
-        if now_ts - last_ts < 2:
-            return
-        DROP_LOCKS[chat_id] = now_ts
-        card = await fetchone("SELECT id,name,rarity,file_type,file_id,file_path FROM cards WHERE owner_id=0 ORDER BY RANDOM() LIMIT 1")
+    drop_n = SETTINGS.get_int("drop_number", DROP_NUMBER_DEFAULT, chat_id=chat_id)
+    # counting happens in memory; COUNTERS flushes groups_seen in batches.
+    # hit() checks and resets the count without awaiting, so each threshold
+    # crossing fires exactly one drop even with concurrent updates.
+    if not COUNTERS.hit(chat_id, drop_n):
+        return
+    # drops in one chat go one at a time; other chats aren't held up
+    async with LOCKS.hold(("chat", chat_id)):
+        columns = "id,name,rarity,file_type,file_id,file_path"
+        rarity_key = DROP_SAMPLER.pick()
+        card = await _pick_unowned(columns, rarity_key)
+        if card is None and rarity_key is not None:
+            # that rarity ran out since the pick (stale pool entries): take any unowned card
+            card = await _pick_unowned(columns)
         if not card:
-            try:
-                await context.bot.send_message(chat_id=chat_id, text="🎲 Drop ဖြစ်ရန် ကြိုးစားခဲ့သော်လည်း unowned card မရှိသေးပါ။ Admin ပေးပါ။")
-            except Exception:
-                pass
+            OUTBOX.send(context.bot.send_message, priority=PRIORITY_NORMAL, chat_id=chat_id,
+                        text="🎲 Drop ဖြစ်ရန် ကြိုးစားခဲ့သော်လည်း unowned card မရှိသေးပါ။ Admin ပေးပါ။")
             return
         card_id, name, rarity, ftype, file_id, file_path = card
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("Claim (ziceko)", callback_data=f"claim:{chat_id}:{card_id}")]])
         caption = f"🎁 Card dropped!\n{name}\nRarity: {rarity}\nPress Claim to grab it!"
-        try:
-            if ftype == "photo":
-                if file_id:
-                    await context.bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, reply_markup=kb)
-                else:
-                    await context.bot.send_photo(chat_id=chat_id, photo=open(file_path, "rb"), caption=caption, reply_markup=kb)
-            else:
-                if file_id:
-                    await context.bot.send_video(chat_id=chat_id, video=file_id, caption=caption, reply_markup=kb)
-                else:
-                    await context.bot.send_video(chat_id=chat_id, video=open(file_path, "rb"), caption=caption, reply_markup=kb)
-            await execute("UPDATE groups_seen SET last_drop_card_id = ? WHERE chat_id = ?", (card_id, chat_id))
-        except Exception as e:
-            logger.exception("drop send failed: %s", e)
+        # queued on the urgent lane; the handler returns without waiting for Telegram
+        OUTBOX.send(send_card, priority=PRIORITY_URGENT, chat=chat_id,
+                    send_photo=context.bot.send_photo, send_video=context.bot.send_video,
+                    card_id=card_id, ftype="photo" if ftype == "photo" else "video", file_id=file_id, file_path=file_path,
+                    chat_id=chat_id, caption=caption, reply_markup=kb)
+        COUNTERS.set_last_drop(chat_id, card_id)
 
+@user_allowed
 async def cb_claim(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     data = query.data or ""
     if not data.startswith("claim:"):
+        await query.answer()
         return
     parts = data.split(":")
-    if len(parts) != 3:
-        await query.edit_message_text("Invalid claim data.")
-        return
     try:
         chat_id = int(parts[1]); card_id = int(parts[2])
     except Exception:
-        await query.edit_message_text("Invalid claim identifiers.")
+        await query.answer("Invalid claim data.", show_alert=True)
         return
     user = query.from_user
-    async with DB_LOCK:
-        r = await fetchone("SELECT owner_id, name, rarity FROM cards WHERE id = ?", (card_id,))
-        if not r:
-            await query.edit_message_text("This card no longer exists.")
-            return
-        owner_id = r[0]
-        if owner_id != 0:
-            await query.edit_message_text("Sorry — someone already claimed it.")
-            return
-        await execute("UPDATE cards SET owner_id = ? WHERE id = ?", (user.id, card_id))
-    await execute("INSERT OR REPLACE INTO users (id, coins) VALUES (?, COALESCE((SELECT coins FROM users WHERE id = ?), 0) + 20)", (user.id, user.id))
-    await query.edit_message_text(f"🎉 {user.full_name} claimed card #{card_id} — {r[1]} ({r[2]})\n(+20 coins)")
-    try:
-        await context.bot.send_message(chat_id=user.id, text=f"✅ သင် {r[1]} (#{card_id}) ကို claim လုပ်ပြီး (+20 coins)!")
-    except Exception:
-        pass
+    # claimers of one drop queue on its card; the ones after the winner see it
+    # gone from POOL and never touch the write lock
+    async with LOCKS.hold(("card", card_id)):
+        claimed = 0
+        if card_id in POOL:
+            async with transaction():
+                # the conditional UPDATE still guards against a stale pool entry
+                claimed = await execute_rowcount("UPDATE cards SET owner_id = ? WHERE id = ? AND owner_id = 0", (user.id, card_id))
+                if claimed:
+                    await ledger.credit(user.id, 20, "claim", ref=card_id)
+                    await LEADERBOARD.save_name(user.id, user.full_name)
+            POOL.remove(card_id)
+    if not claimed:
+        # losers get a private alert; the drop message keeps the winner's text
+        r = await fetchone("SELECT 1 FROM cards WHERE id = ?", (card_id,))
+        await query.answer("Sorry — someone already claimed it." if r else "This card no longer exists.", show_alert=True)
+        return
+    await query.answer()
+    r = await fetchone("SELECT name, rarity, rarity_key FROM cards WHERE id = ?", (card_id,))
+    LEADERBOARD.card_gained(user.id, r[2], user.full_name)
+    _edit_query_message(query, f"🎉 {user.full_name} claimed card #{card_id} — {r[0]} ({r[1]})\n(+20 coins)")
+    OUTBOX.send(context.bot.send_message, priority=PRIORITY_LOW, chat_id=user.id,
+                text=f"✅ သင် {r[0]} (#{card_id}) ကို claim လုပ်ပြီး (+20 coins)!")
 
 # --- startup ---
+def _register_gauges():
+    caches = {"inline": INLINE_CACHE, "media_file_id": RECENT_FILE_IDS}
+    caches["balance"] = ledger.BALANCE_CACHE
+    METRICS.gauge("cache_hit_ratio", lambda: {(("cache", n),): c.stats()["hit_rate"] for n, c in caches.items()})
+    METRICS.gauge("cache_entries", lambda: {(("cache", n),): len(c) for n, c in caches.items()})
+    METRICS.gauge("unowned_cards", lambda: POOL.available())
+    METRICS.gauge("outbox_pending", lambda: OUTBOX.pending)
+    METRICS.gauge("startup_seconds", lambda: {(("phase", n),): s for n, s in STARTUP.phases})
+
 async def main():
     if not TOKEN:
         raise RuntimeError("TOKEN missing in .env")
-    await init_db_and_dirs()
-    application = ApplicationBuilder().token(TOKEN).build()
-
+    STARTUP.mark("imports")
+    with STARTUP.phase("db"):
+        await init_db_and_dirs()
+    await STARTUP.prewarm(counters=COUNTERS.load(), pool=POOL.load(), leaderboard=LEADERBOARD.load(),
+                          authz=AUTHZ.load(), settings=SETTINGS.load())
+    COUNTERS.start(COUNTER_FLUSH_INTERVAL)
+    OUTBOX.start()
+    builder = ApplicationBuilder().token(TOKEN).concurrent_updates(CONCURRENT_UPDATES)
+    if BOT_MODE == "webhook":
+        # updates arrive through WebhookServer, no getUpdates loop
+        builder = builder.updater(None)
+    if METRICS_ENABLED:
+        # same pool size PTB uses by default, plus per-method API latency
+        builder = builder.request(TimedRequest(connection_pool_size=256))
+    application = builder.build()
+    # read by owner_only / admin_or_owner
+    application.bot_data['OWNER_ID'] = OWNER_ID
     # basic
     application.add_handler(CommandHandler("start", cmd_start))
 
@@ -391,12 +684,24 @@ async def main():
     application.add_handler(CommandHandler("uploadvd", cmd_uploadvd))
     application.add_handler(CommandHandler("setdrop", cmd_setdrop))
     application.add_handler(CommandHandler("backup", cmd_backup))
+    application.add_handler(CommandHandler("ban", cmd_ban))
+    application.add_handler(CommandHandler("unban", cmd_unban))
+    application.add_handler(CommandHandler("mute", cmd_mute))
+    application.add_handler(CommandHandler("unmute", cmd_unmute))
+    application.add_handler(CommandHandler("addsudo", cmd_addsudo))
+    application.add_handler(CommandHandler("rmsudo", cmd_rmsudo))
+    application.add_handler(CommandHandler("import", cmd_import))
+    application.add_handler(CommandHandler("cardstats", cmd_cardstats))
+    application.add_handler(MessageHandler(filters.Document.ZIP & filters.CaptionRegex(r'^/import'), cmd_import))
 
     # user
     application.add_handler(CommandHandler("harem", cmd_harem))
+    application.add_handler(CallbackQueryHandler(cb_harem, pattern=r'^harem:'))
     application.add_handler(CommandHandler("see", cmd_see))
     application.add_handler(CommandHandler("balance", cmd_balance))
     application.add_handler(CommandHandler("daily", cmd_daily))
+    application.add_handler(CommandHandler("top", cmd_top))
+    application.add_handler(CommandHandler("stats", cmd_stats))
     application.add_handler(CommandHandler("shop", cmd_shop_buttons))
     application.add_handler(CallbackQueryHandler(cb_shop, pattern=r'^(shop:|shopbuy:)'))
 
@@ -407,10 +712,69 @@ async def main():
     # group message
     application.add_handler(MessageHandler(filters.ChatType.GROUPS & ~filters.UpdateType.EDITED, on_group_message))
 
-    logger.info("Starting Catch Character Bot")
+    metrics_tasks = []
+    metrics_server = None
+    if METRICS_ENABLED:
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = timed_handler(handler.callback)
+        _register_gauges()
+        if METRICS_PORT:
+            metrics_server = await serve_metrics()
+        if METRICS_LOG_INTERVAL > 0:
+            metrics_tasks.append(asyncio.create_task(metrics_log_loop(METRICS_LOG_INTERVAL)))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+
+    prewarm_task = None
+    webhook = None
+    logger.info("Starting Catch Character Bot (%s mode)", BOT_MODE)
     try:
-        await application.run_polling()
+        async with application:
+            await application.start()
+            if BOT_MODE == "webhook":
+                # aiohttp is only imported when it's needed
+                from webhook import WebhookServer
+                webhook = WebhookServer(application)
+                await webhook.start()
+            else:
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            # building the app, getMe, and starting polling / the webhook server
+            STARTUP.mark("telegram")
+            STARTUP.report()
+            INGEST.start(application.bot)
+            # backfill file_ids for cards that only exist on disk
+            prewarm_chat = MEDIA_PREWARM_CHAT or str(OWNER_ID)
+            if prewarm_chat.lstrip("-").isdigit():
+                prewarm_task = asyncio.create_task(prewarm_loop(application.bot, int(prewarm_chat), MEDIA_PREWARM_INTERVAL))
+
+            await stop.wait()
+            logger.info("Stopping: no new updates, draining in-flight ones")
+            if webhook is not None:
+                await webhook.stop()
+            elif application.updater.running:
+                await application.updater.stop()
+            try:
+                # handles everything already queued and waits for running handlers
+                await asyncio.wait_for(application.stop(), DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("updates still running after %.0fs, shutting down anyway", DRAIN_TIMEOUT)
     finally:
+        for task in metrics_tasks:
+            task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        if prewarm_task is not None:
+            prewarm_task.cancel()
+        await INGEST.stop()
+        await OUTBOX.stop()
+        await COUNTERS.stop()
         await close_db()
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+# media.py
+# card media sends with file_id backfill: a disk file goes to Telegram at most once
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from db import fetchall, execute
+from cache import TTLCache
+from outbox import OUTBOX, PRIORITY_BULK
+
+logger = logging.getLogger("catch_character_bot.media")
+
+# card_id -> future of an upload in flight (resolves to the new file_id or None)
+_UPLOADS: Dict[int, asyncio.Future] = {}
+# file_ids captured recently, for callers holding a row read before the backfill
+RECENT_FILE_IDS = TTLCache(maxsize=4096, ttl=600)
+
+
+def returned_file_id(msg, ftype: str) -> Optional[str]:
+    """file_id Telegram assigned to the media of a sent message."""
+    if msg is None:
+        return None
+    if ftype == "photo":
+        return msg.photo[-1].file_id if msg.photo else None
+    return msg.video.file_id if msg.video else None
+
+
+async def send_card(send_photo, send_video, card_id: int, ftype: str, file_id: Optional[str],
+                    file_path: Optional[str], **kwargs):
+    """Send a card's media through send_photo/send_video (bot.send_* or message.reply_*).
+
+    Without a file_id the file is uploaded from disk once, the returned
+    file_id is stored in ``cards`` and concurrent senders of the same card
+    wait for it instead of uploading again.
+    """
+    send, field = (send_photo, "photo") if ftype == "photo" else (send_video, "video")
+    file_id = file_id or RECENT_FILE_IDS.get(card_id)
+    if not file_id:
+        pending = _UPLOADS.get(card_id)
+        if pending is not None:
+            file_id = await asyncio.shield(pending)
+    if file_id:
+        return await send(**{field: file_id}, **kwargs)
+    fut = asyncio.get_running_loop().create_future()
+    _UPLOADS[card_id] = fut
+    new_id = None
+    try:
+        with open(file_path, "rb") as fh:
+            msg = await send(**{field: fh}, **kwargs)
+        new_id = returned_file_id(msg, ftype)
+        if new_id:
+            await execute("UPDATE cards SET file_id = ? WHERE id = ?", (new_id, card_id))
+            RECENT_FILE_IDS.set(card_id, new_id)
+        return msg
+    finally:
+        _UPLOADS.pop(card_id, None)
+        fut.set_result(new_id)
+
+
+async def prewarm_file_ids(bot, chat_id: int, batch: int = 50) -> int:
+    """Upload every card lacking a file_id once (to chat_id) and store the file_ids.
+
+    Uploads go through the outbox's bulk lane, so they never delay drops or
+    DMs; the warm-up messages are deleted again. Returns the number backfilled.
+    """
+    done = 0
+    last_id = 0
+    while True:
+        rows = await fetchall("SELECT id, file_type, file_path FROM cards WHERE (file_id IS NULL OR file_id = '') "
+                              "AND file_path IS NOT NULL AND id > ? ORDER BY id LIMIT ?", (last_id, batch))
+        if not rows:
+            break
+        for cid, ftype, path in rows:
+            last_id = cid
+            if ftype not in ("photo", "video"):
+                continue
+            msg = await OUTBOX.send(send_card, priority=PRIORITY_BULK, chat=chat_id,
+                                    send_photo=bot.send_photo, send_video=bot.send_video,
+                                    card_id=cid, ftype=ftype, file_id=None, file_path=path,
+                                    chat_id=chat_id, disable_notification=True)
+            if msg is None:
+                continue
+            done += 1
+            OUTBOX.send(bot.delete_message, priority=PRIORITY_BULK, chat_id=chat_id, message_id=msg.message_id)
+    if done:
+        logger.info("pre-warmed file_ids for %d cards", done)
+    return done
+
+
+async def prewarm_loop(bot, chat_id: int, interval: float):
+    """Run prewarm_file_ids now and then every interval seconds."""
+    while True:
+        try:
+            await prewarm_file_ids(bot, chat_id)
+        except Exception as e:
+            logger.exception("file_id prewarm failed: %s", e)
+        await asyncio.sleep(interval)
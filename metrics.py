@@ -0,0 +1,211 @@
+# metrics.py
+# in-process latency histograms + gauges, served as Prometheus text and/or dumped to the log
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List, Tuple, Union
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger("catch_character_bot.metrics")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))                     # 0 = no HTTP endpoint
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))   # 0 = no periodic dump
+# queries slower than this are logged even with metrics disabled (0 = off)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+# db checks this once per query; when False no clock is read at all
+TIMING = METRICS_ENABLED or SLOW_QUERY_MS > 0
+
+# upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+GaugeFn = Callable[[], Union[float, Dict[Labels, float]]]
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (coarse, but free)."""
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return 0.0
+
+
+class Metrics:
+    """Histograms keyed by (name, labels) plus gauges computed on scrape."""
+
+    def __init__(self):
+        self._hist: Dict[Tuple[str, Labels], Histogram] = {}
+        self._gauges: Dict[str, GaugeFn] = {}
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(labels.items()))
+        h = self._hist.get(key)
+        if h is None:
+            h = self._hist[key] = Histogram()
+        h.observe(seconds)
+
+    def gauge(self, name: str, fn: GaugeFn):
+        """fn returns a number, or {labels: number} for a labelled family."""
+        self._gauges[name] = fn
+
+    def _gauge_values(self):
+        for name, fn in self._gauges.items():
+            try:
+                value = fn()
+            except Exception as e:
+                logger.debug("gauge %s failed: %s", name, e)
+                continue
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            for labels, v in items:
+                yield name, labels, v
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        out: List[str] = []
+        typed = set()
+        for (name, labels), h in sorted(self._hist.items()):
+            if name not in typed:
+                out.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cum = 0
+            for i, c in enumerate(h.counts):
+                cum += c
+                le = "+Inf" if i == len(BUCKETS) else repr(BUCKETS[i])
+                out.append(f"{name}_bucket{_fmt(labels + (('le', le),))} {cum}")
+            out.append(f"{name}_sum{_fmt(labels)} {h.sum}")
+            out.append(f"{name}_count{_fmt(labels)} {h.count}")
+        for name, labels, v in self._gauge_values():
+            if name not in typed:
+                out.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            out.append(f"{name}{_fmt(labels)} {v}")
+        return "\n".join(out) + "\n"
+
+    def summary(self) -> List[str]:
+        """One line per series, busiest first, for the periodic log dump."""
+        lines = []
+        for (name, labels), h in sorted(self._hist.items(), key=lambda kv: -kv[1].sum):
+            if h.count:
+                lines.append(f"{name}{_fmt(labels)} n={h.count} avg={h.sum / h.count * 1000:.2f}ms "
+                             f"p99<={h.quantile(0.99) * 1000:g}ms total={h.sum:.2f}s")
+        for name, labels, v in self._gauge_values():
+            lines.append(f"{name}{_fmt(labels)} {v:g}")
+        return lines
+
+
+def _fmt(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels) + "}"
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+METRICS = Metrics()
+
+# query text -> collapsed label (queries are code constants, so this stays small)
+_QUERY_LABELS: Dict[str, str] = {}
+
+
+def _query_label(query: str) -> str:
+    label = _QUERY_LABELS.get(query)
+    if label is None:
+        label = " ".join(query.split())[:120]
+        if len(_QUERY_LABELS) < 1000:
+            _QUERY_LABELS[query] = label
+    return label
+
+
+def observe_query(op: str, query: str, seconds: float):
+    """Called by db for every statement when TIMING is on."""
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning("slow %s (%.1f ms): %s", op, seconds * 1000, _query_label(query))
+    if METRICS_ENABLED:
+        METRICS.observe("db_query_seconds", seconds, op=op, query=_query_label(query))
+
+
+def timed_handler(callback):
+    """Wrap a PTB handler callback to record its latency (returned unchanged when disabled)."""
+    if not METRICS_ENABLED:
+        return callback
+    name = getattr(callback, "__name__", repr(callback))
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        t0 = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            METRICS.observe("handler_seconds", time.perf_counter() - t0, handler=name)
+    return wrapper
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency of every Bot API call by method."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            METRICS.observe("telegram_api_seconds", time.perf_counter() - t0, method=url.rsplit("/", 1)[-1])
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # skip the headers; scrapes carry no body
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", METRICS.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        logger.debug("metrics scrape failed: %s", e)
+    finally:
+        writer.close()
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> asyncio.AbstractServer:
+    """Serve GET /metrics on host:port."""
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info("metrics endpoint on http://%s:%d/metrics", host, port)
+    return server
+
+
+async def log_loop(interval: float):
+    """Dump the summary to the log every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        lines = METRICS.summary()
+        if lines:
+            logger.info("metrics:\n  %s", "\n  ".join(lines))
@@ -0,0 +1,203 @@
+# migrations.py
+# schema versions for db.py, applied in order and recorded in PRAGMA user_version
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, List, Tuple, Union
+
+import aiosqlite
+
+logger = logging.getLogger("catch_character_bot.migrations")
+
+# a step is an SQL script, or a coroutine function taking the connection
+# (which must not call executescript: that would commit mid-migration)
+Step = Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+
+async def _add_column(conn: aiosqlite.Connection, table: str, column: str, decl: str):
+    async with conn.execute(f"PRAGMA table_info({table})") as cur:
+        cols = {r[1] for r in await cur.fetchall()}
+    if column not in cols:
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def _exists(conn: aiosqlite.Connection, name: str) -> bool:
+    async with conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)) as cur:
+        return await cur.fetchone() is not None
+
+
+async def _content_hash(conn: aiosqlite.Connection):
+    await _add_column(conn, "cards", "content_hash", "TEXT")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_cards_content_hash ON cards (content_hash)")
+
+
+async def _search_index(conn: aiosqlite.Connection):
+    """FTS5 index over cards(name, movie), kept in sync by triggers.
+
+    Uses the trigram tokenizer (substring matches) when this SQLite has it,
+    otherwise unicode61 with prefix indexes; without FTS5 nothing is created
+    and search_cards falls back to LIKE.
+    """
+    if await _exists(conn, "cards_fts"):
+        return
+    for options in ("tokenize='trigram'", "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'"):
+        try:
+            await conn.execute(f"CREATE VIRTUAL TABLE cards_fts USING fts5(name, movie, content='cards', content_rowid='id', {options})")
+        except Exception:
+            continue
+        break
+    else:
+        logger.warning("FTS5 unavailable, card search uses LIKE")
+        return
+    await conn.execute("""CREATE TRIGGER IF NOT EXISTS cards_fts_ai AFTER INSERT ON cards BEGIN
+        INSERT INTO cards_fts (rowid, name, movie) VALUES (new.id, new.name, new.movie);
+    END""")
+    await conn.execute("""CREATE TRIGGER IF NOT EXISTS cards_fts_ad AFTER DELETE ON cards BEGIN
+        INSERT INTO cards_fts (cards_fts, rowid, name, movie) VALUES ('delete', old.id, old.name, old.movie);
+    END""")
+    await conn.execute("""CREATE TRIGGER IF NOT EXISTS cards_fts_au AFTER UPDATE OF name, movie ON cards BEGIN
+        INSERT INTO cards_fts (cards_fts, rowid, name, movie) VALUES ('delete', old.id, old.name, old.movie);
+        INSERT INTO cards_fts (rowid, name, movie) VALUES (new.id, new.name, new.movie);
+    END""")
+    await conn.execute("INSERT INTO cards_fts (cards_fts) VALUES ('rebuild')")
+
+
+async def _short_search_index(conn: aiosqlite.Connection):
+    """Word-prefix index for 1-2 character queries next to a trigram cards_fts.
+
+    Trigram can't match terms shorter than 3 characters; without this those
+    queries would scan cards. Not needed when cards_fts is unicode61 (it
+    has its own prefix indexes) or missing.
+    """
+    async with conn.execute("SELECT sql FROM sqlite_master WHERE name = 'cards_fts'") as cur:
+        row = await cur.fetchone()
+    if not row or 'trigram' not in row[0]:
+        return
+    await conn.execute("CREATE VIRTUAL TABLE cards_fts_short USING fts5(name, movie, content='cards', content_rowid='id', "
+                       "tokenize='unicode61 remove_diacritics 2', prefix='1 2')")
+    await conn.execute("""CREATE TRIGGER cards_fts_short_ai AFTER INSERT ON cards BEGIN
+        INSERT INTO cards_fts_short (rowid, name, movie) VALUES (new.id, new.name, new.movie);
+    END""")
+    await conn.execute("""CREATE TRIGGER cards_fts_short_ad AFTER DELETE ON cards BEGIN
+        INSERT INTO cards_fts_short (cards_fts_short, rowid, name, movie) VALUES ('delete', old.id, old.name, old.movie);
+    END""")
+    await conn.execute("""CREATE TRIGGER cards_fts_short_au AFTER UPDATE OF name, movie ON cards BEGIN
+        INSERT INTO cards_fts_short (cards_fts_short, rowid, name, movie) VALUES ('delete', old.id, old.name, old.movie);
+        INSERT INTO cards_fts_short (rowid, name, movie) VALUES (new.id, new.name, new.movie);
+    END""")
+    await conn.execute("INSERT INTO cards_fts_short (cards_fts_short) VALUES ('rebuild')")
+
+
+async def _ledger(conn: aiosqlite.Connection):
+    """Append-only coin_ledger; its trigger is the only writer of users.coins.
+
+    Each row carries the balance after it, so a user's rows replay to their
+    current coins. Existing balances get one 'opening' row.
+    """
+    if await _exists(conn, "coin_ledger"):
+        return
+    await conn.execute("""CREATE TABLE coin_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        ref TEXT,
+        balance INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )""")
+    await conn.execute("CREATE INDEX idx_coin_ledger_user ON coin_ledger (user_id, id)")
+    await conn.execute("""CREATE TRIGGER coin_ledger_apply AFTER INSERT ON coin_ledger BEGIN
+        INSERT INTO users (id, coins) VALUES (new.user_id, new.balance)
+            ON CONFLICT(id) DO UPDATE SET coins = excluded.coins;
+        INSERT INTO daily (user_id, last_claim) SELECT new.user_id, new.created_at WHERE new.reason = 'daily'
+            ON CONFLICT(user_id) DO UPDATE SET last_claim = excluded.last_claim;
+    END""")
+    await conn.execute("INSERT INTO coin_ledger (user_id, delta, reason, balance, created_at) "
+                       "SELECT id, coins, 'opening', coins, ? FROM users WHERE coins != 0",
+                       (datetime.utcnow().isoformat(),))
+
+
+# (name, step); version N is MIGRATIONS[N - 1]. Only ever append.
+# 1-7 are idempotent because databases created before versioning (user_version
+# 0) already have some of them; later steps can assume the version before.
+MIGRATIONS: List[Tuple[str, Step]] = [
+    ("base tables", """
+    CREATE TABLE IF NOT EXISTS cards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        movie TEXT,
+        rarity TEXT,
+        rarity_key TEXT,
+        file_type TEXT,
+        file_id TEXT,
+        file_path TEXT,
+        owner_id INTEGER DEFAULT 0,
+        created_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        coins INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS daily (user_id INTEGER PRIMARY KEY, last_claim TEXT);
+    CREATE TABLE IF NOT EXISTS banned (id INTEGER PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS muted (id INTEGER PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS sudo (id INTEGER PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS groups_seen (chat_id INTEGER PRIMARY KEY, messages_count INTEGER DEFAULT 0, last_drop_card_id INTEGER DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+    """),
+    ("cards owner/rarity indexes", """
+    CREATE INDEX IF NOT EXISTS idx_cards_owner_id ON cards (owner_id, id);
+    CREATE INDEX IF NOT EXISTS idx_cards_owner_rarity_id ON cards (owner_id, rarity_key, id);
+    CREATE INDEX IF NOT EXISTS idx_cards_rarity_owner ON cards (rarity_key, owner_id);
+    """),
+    ("chat_settings", """
+    CREATE TABLE IF NOT EXISTS chat_settings (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY (chat_id, key));
+    """),
+    ("cards_fts", _search_index),
+    ("cards.content_hash", _content_hash),
+    ("coin_ledger", _ledger),
+    ("ingest_jobs", """
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        card_id INTEGER PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        file_type TEXT NOT NULL,
+        chat_id INTEGER,
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT
+    );
+    """),
+    ("cards_fts_short", _short_search_index),
+]
+
+LATEST = len(MIGRATIONS)
+
+
+async def migrate(conn: aiosqlite.Connection) -> int:
+    """Bring conn up to LATEST; returns how many migrations ran.
+
+    Each migration and its user_version bump commit together, so a failed
+    one leaves the database at the previous version.
+    """
+    async with conn.execute("PRAGMA user_version") as cur:
+        version = (await cur.fetchone())[0]
+    if version > LATEST:
+        logger.warning("database is at schema version %d, this code knows up to %d", version, LATEST)
+        return 0
+    for number in range(version + 1, LATEST + 1):
+        name, step = MIGRATIONS[number - 1]
+        try:
+            if isinstance(step, str):
+                await conn.executescript(f"BEGIN;\n{step}\nPRAGMA user_version = {number};\nCOMMIT;")
+            else:
+                await conn.execute("BEGIN")
+                await step(conn)
+                await conn.execute(f"PRAGMA user_version = {number}")
+                await conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                await conn.rollback()
+            logger.error("migration %d (%s) failed", number, name)
+            raise
+        logger.info("applied migration %d: %s", number, name)
+    return LATEST - version
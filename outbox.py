@@ -0,0 +1,240 @@
+# outbox.py
+# central outbound Telegram dispatcher: priority lanes, token buckets, retries
+import os
+import time
+import asyncio
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+
+logger = logging.getLogger("catch_character_bot.outbox")
+
+# lanes, lowest value goes first
+PRIORITY_URGENT = 0   # drops, claim / purchase result edits
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2      # DMs
+PRIORITY_BULK = 3     # backup uploads
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))     # msgs/sec across all chats
+GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", "0.33"))     # ~20 msgs/min per group
+PRIVATE_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", "1"))    # 1 msg/sec per private chat
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst and self.blocked_until <= time.monotonic()
+
+
+class _Job:
+    __slots__ = ("func", "kwargs", "chat_id", "key", "future", "attempts", "priority", "seq", "queued")
+
+    def __init__(self, func, kwargs, chat_id, key, future, priority, seq):
+        self.func = func
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.key = key
+        self.future = future
+        self.attempts = 0
+        self.priority = priority
+        self.seq = seq
+        self.queued = time.monotonic()
+
+    def __lt__(self, other: "_Job"):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbox:
+    """Queue of outbound Bot API calls drained by a few worker tasks.
+
+    ``send`` enqueues and returns at once with a future resolving to the API
+    result (or None once the call finally failed -- failures are logged,
+    never swallowed silently). Jobs with the same ``coalesce_key`` that have
+    not started yet are merged, the last payload wins.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._pending: Dict[Hashable, _Job] = {}
+        self._seq = itertools.count()
+        self._open = 0  # jobs queued, delayed or running, not resolved yet
+
+    def send(self, func: Callable[..., Awaitable[Any]], *, chat: Optional[int] = None,
+             priority: int = PRIORITY_NORMAL, coalesce_key: Optional[Hashable] = None, **kwargs) -> asyncio.Future:
+        """Queue ``func(**kwargs)``; ``chat`` (default: kwargs['chat_id']) picks the rate limit bucket."""
+        if chat is None:
+            chat = kwargs.get("chat_id")
+        if coalesce_key is not None:
+            job = self._pending.get(coalesce_key)
+            if job is not None:
+                # not sent yet: keep its place in the queue, send the newest payload
+                job.func, job.kwargs = func, kwargs
+                return job.future
+        loop = asyncio.get_running_loop()
+        job = _Job(func, kwargs, chat, coalesce_key, loop.create_future(), priority, next(self._seq))
+        self._open += 1
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = job
+        if self._queue is None:
+            # not started (e.g. scripts/tests): run inline
+            asyncio.create_task(self._run(job))
+        else:
+            self._queue.put_nowait(job)
+        return job.future
+
+    def _bucket_for(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            rate = GROUP_RATE if chat_id < 0 else PRIVATE_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate, 3)
+        return bucket
+
+    def _later(self, job: _Job, delay: float):
+        def put():
+            if self._queue is not None:
+                self._queue.put_nowait(job)
+        asyncio.get_running_loop().call_later(delay, put)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                bucket = self._bucket_for(job.chat_id) if job.chat_id is not None else None
+                if bucket is not None:
+                    wait = bucket.wait_time()
+                    if wait > 0:
+                        self._later(job, wait)
+                        continue
+                while True:
+                    wait = self._global.wait_time()
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self._global.consume()
+                if bucket is not None:
+                    bucket.consume()
+                await self._run(job)
+            except Exception as e:
+                logger.exception("outbox worker error: %s", e)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: _Job):
+        if job.key is not None and self._pending.get(job.key) is job:
+            del self._pending[job.key]
+        job.attempts += 1
+        if job.attempts == 1 and metrics.METRICS_ENABLED:
+            # time spent waiting for a worker / rate limit tokens, per lane
+            metrics.METRICS.observe("outbox_wait_seconds", time.monotonic() - job.queued, lane=job.priority)
+        try:
+            result = await job.func(**job.kwargs)
+        except RetryAfter as e:
+            delay = float(e.retry_after)
+            logger.warning("flood limit on chat %s, retrying in %.1fs", job.chat_id, delay)
+            if job.chat_id is not None:
+                self._bucket_for(job.chat_id).block(delay)
+            else:
+                self._global.block(delay)
+            self._retry(job, delay)
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.error("send to %s rejected: %s", job.chat_id, e)
+            self._resolve(job, None)
+            return
+        except NetworkError as e:
+            # includes TimedOut
+            if job.attempts < MAX_ATTEMPTS:
+                logger.warning("send to %s failed (%s), attempt %d", job.chat_id, e, job.attempts)
+                self._retry(job, min(30.0, 2.0 ** job.attempts))
+                return
+            logger.error("dropping send to %s after %d attempts: %s", job.chat_id, job.attempts, e)
+            self._resolve(job, None)
+            return
+        except Forbidden as e:
+            logger.info("chat %s unreachable: %s", job.chat_id, e)
+            self._resolve(job, None)
+            return
+        except Exception as e:
+            logger.exception("send to %s failed: %s", job.chat_id, e)
+            self._resolve(job, None)
+            return
+        self._resolve(job, result)
+
+    def _retry(self, job: _Job, delay: float):
+        if self._queue is None:
+            async def again():
+                await asyncio.sleep(delay)
+                await self._run(job)
+            asyncio.create_task(again())
+        else:
+            self._later(job, delay)
+
+    def _resolve(self, job: _Job, result):
+        self._open -= 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    @property
+    def pending(self) -> int:
+        return self._open
+
+    def start(self, workers: int = OUTBOX_WORKERS):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def stop(self, timeout: float = 30.0):
+        """Drain queued sends (up to timeout seconds), then stop the workers."""
+        if self._queue is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._open and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._open:
+            logger.warning("outbox stopped with %d sends pending", self._open)
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+
+OUTBOX = Outbox()
@@ -0,0 +1,93 @@
+# sampler.py
+# weighted sampling in O(1) per draw (Walker/Vose alias tables), with availability-aware rarity picks
+import random
+import logging
+from typing import Dict, Generic, Hashable, Iterable, List, Optional, Sequence, TypeVar
+
+logger = logging.getLogger("catch_character_bot.sampler")
+
+K = TypeVar("K", bound=Hashable)
+
+
+class AliasTable(Generic[K]):
+    """Walker alias table: draws a key with probability weight/sum(weights) in O(1).
+
+    Building is O(n); keys with weight <= 0 are left out. An empty table
+    samples None.
+    """
+
+    def __init__(self, keys: Sequence[K], weights: Sequence[float]):
+        pairs = [(k, float(w)) for k, w in zip(keys, weights) if w > 0]
+        self.keys: List[K] = [k for k, _ in pairs]
+        n = len(pairs)
+        self._prob = [1.0] * n
+        self._alias = list(range(n))
+        if not n:
+            return
+        total = sum(w for _, w in pairs)
+        scaled = [w * n / total for _, w in pairs]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # leftovers are 1.0 up to rounding error
+        for i in small + large:
+            self._prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sample(self, rng: random.Random = random) -> Optional[K]:
+        if not self.keys:
+            return None
+        u = rng.random() * len(self.keys)
+        i = int(u)
+        return self.keys[i] if u - i < self._prob[i] else self.keys[self._alias[i]]
+
+    def sample_many(self, n: int, rng: random.Random = random) -> List[K]:
+        return [self.sample(rng) for _ in range(n)]
+
+
+class RaritySampler:
+    """Weighted rarity picks restricted to rarities that currently have unowned cards.
+
+    ``set_available`` is meant to be wired to ``UnownedPool.on_rarity_change``:
+    the alias table is rebuilt only when a rarity empties or refills, so a
+    pick never lands on an exhausted rarity and never needs a retry.
+    """
+
+    def __init__(self, weights: Dict[str, float], seed: Optional[int] = None, rng: Optional[random.Random] = None):
+        self.weights = dict(weights)
+        self.rng = rng or random.Random(seed)
+        self._available: set = set()
+        self._table: AliasTable[str] = AliasTable([], [])
+
+    def _rebuild(self):
+        keys = [k for k in self.weights if k in self._available]
+        self._table = AliasTable(keys, [self.weights[k] for k in keys])
+        logger.debug("rarity sampler rebuilt over %s", keys)
+
+    def set_available(self, rarity_key: str, available: bool):
+        if available == (rarity_key in self._available):
+            return
+        if available:
+            self._available.add(rarity_key)
+        else:
+            self._available.discard(rarity_key)
+        if rarity_key in self.weights:
+            self._rebuild()
+
+    def reset(self, available: Iterable[str]):
+        self._available = set(available)
+        self._rebuild()
+
+    def pick(self) -> Optional[str]:
+        """A rarity_key with unowned cards (weighted), or None if none is available."""
+        return self._table.sample(self.rng)
+
+    def pick_many(self, n: int) -> List[Optional[str]]:
+        return self._table.sample_many(n, self.rng)
@@ -0,0 +1,86 @@
+# settings.py
+# typed, in-memory view of the settings / chat_settings tables
+import logging
+from typing import Callable, Dict, List, Optional
+
+from db import fetchall, execute
+
+logger = logging.getLogger("catch_character_bot.settings")
+
+# listener(key, value, chat_id) -- value is None when the key was removed
+Listener = Callable[[str, Optional[str], Optional[int]], None]
+
+
+class Settings:
+    """Global settings plus per-chat overrides, served from memory.
+
+    Reads never touch the database. Writers go through ``set``/``unset``,
+    which persist first and then swap the in-memory value in one step and
+    notify listeners registered with ``on_change``.
+    """
+
+    def __init__(self):
+        self._global: Dict[str, str] = {}
+        self._chat: Dict[int, Dict[str, str]] = {}
+        self._listeners: List[Listener] = []
+
+    async def load(self):
+        rows = await fetchall("SELECT key, value FROM settings")
+        self._global = {k: v for k, v in rows}
+        chat: Dict[int, Dict[str, str]] = {}
+        for chat_id, k, v in await fetchall("SELECT chat_id, key, value FROM chat_settings"):
+            chat.setdefault(chat_id, {})[k] = v
+        self._chat = chat
+        logger.info("loaded %d settings, overrides for %d chats", len(self._global), len(chat))
+
+    def get(self, key: str, default: Optional[str] = None, chat_id: Optional[int] = None) -> Optional[str]:
+        """Per-chat override if there is one, else the global value, else default."""
+        if chat_id is not None:
+            overrides = self._chat.get(chat_id)
+            if overrides and key in overrides:
+                return overrides[key]
+        return self._global.get(key, default)
+
+    def get_int(self, key: str, default: int, chat_id: Optional[int] = None) -> int:
+        raw = self.get(key, None, chat_id)
+        if raw is None:
+            return default
+        try:
+            return int(raw)
+        except ValueError:
+            logger.warning("setting %s=%r is not an int; using %s", key, raw, default)
+            return default
+
+    async def set(self, key: str, value, chat_id: Optional[int] = None):
+        value = str(value)
+        if chat_id is None:
+            await execute("INSERT INTO settings (key, value) VALUES (?,?) "
+                          "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+            self._global[key] = value
+        else:
+            await execute("INSERT INTO chat_settings (chat_id, key, value) VALUES (?,?,?) "
+                          "ON CONFLICT(chat_id, key) DO UPDATE SET value = excluded.value", (chat_id, key, value))
+            self._chat.setdefault(chat_id, {})[key] = value
+        self._notify(key, value, chat_id)
+
+    async def unset(self, key: str, chat_id: Optional[int] = None):
+        if chat_id is None:
+            await execute("DELETE FROM settings WHERE key = ?", (key,))
+            self._global.pop(key, None)
+        else:
+            await execute("DELETE FROM chat_settings WHERE chat_id = ? AND key = ?", (chat_id, key))
+            self._chat.get(chat_id, {}).pop(key, None)
+        self._notify(key, None, chat_id)
+
+    def on_change(self, listener: Listener):
+        self._listeners.append(listener)
+
+    def _notify(self, key: str, value: Optional[str], chat_id: Optional[int]):
+        for listener in self._listeners:
+            try:
+                listener(key, value, chat_id)
+            except Exception as e:
+                logger.exception("settings listener failed: %s", e)
+
+
+SETTINGS = Settings()
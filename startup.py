@@ -0,0 +1,65 @@
+# startup.py
+# times the startup phases (imports, db, prewarm, telegram) and logs one report once serving
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Awaitable, Dict, List, Tuple
+
+logger = logging.getLogger("catch_character_bot.startup")
+
+
+class StartupTimer:
+    """Phase durations since this module was imported (i.e. right after interpreter start).
+
+    ``phase`` times a block, ``mark`` closes the phase that ran since the
+    previous one (used for the import time of main.py), ``prewarm`` runs
+    loaders concurrently and times each one.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self._last = self.t0
+        self.phases: List[Tuple[str, float]] = []
+
+    def _record(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self._record(name, now - self._last)
+        self._last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self._record(name, self._last - t0)
+
+    async def prewarm(self, **loaders: Awaitable):
+        """Await all loaders at once (they read through the reader pool in parallel)."""
+        async def timed(name: str, aw: Awaitable):
+            t0 = time.perf_counter()
+            await aw
+            return name, time.perf_counter() - t0
+
+        with self.phase("prewarm"):
+            results = await asyncio.gather(*(timed(n, aw) for n, aw in loaders.items()))
+        for name, seconds in results:
+            self._record(f"prewarm.{name}", seconds)
+
+    def seconds(self) -> Dict[str, float]:
+        return dict(self.phases)
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.t0
+        parts = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        line = f"ready in {total * 1000:.0f}ms ({parts})"
+        logger.info(line)
+        return line
+
+
+STARTUP = StartupTimer()
@@ -1,11 +1,18 @@
-## part3
-# part3_utils.py
+# utils.py
 # helpers: permissions, pick_rarity, shop keyboard, and misc
+from __future__ import annotations
+
 import random
 from functools import wraps
-from typing import Optional
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
+from typing import TYPE_CHECKING, Optional
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+if TYPE_CHECKING:  # only used in annotations; telegram.ext is slow to import
+    from telegram import Update
+    from telegram.ext import ContextTypes
+
+from authz import AUTHZ
+from sampler import AliasTable
 
 # rarities (same as original but centralized)
 RARITY_LEVELS = [
@@ -22,6 +29,7 @@ RARITY_LEVELS = [
 ]
 RARITY_WEIGHTS = [40, 25, 12, 8, 5, 4, 3, 1, 1, 1]
 RARITY_LABEL_MAP = {k: lbl for k, lbl in RARITY_LEVELS}
+RARITY_TABLE = AliasTable([k for k, _ in RARITY_LEVELS], RARITY_WEIGHTS)
 SHOP = {
     "common": 50,
     "uncommon": 80,
@@ -49,7 +57,13 @@ def owner_only(func):
         return await func(update, context)
     return wrapper
 
-# admin_or_owner and user_allowed will require DB queries, but we keep decorator shapes here
+async def _deny(update: Update, text: str):
+    if update.callback_query:
+        await update.callback_query.answer(text, show_alert=True)
+    elif update.message:
+        await update.message.reply_text(text)
+
+# admin_or_owner and user_allowed check the in-memory AUTHZ sets, never the DB
 def admin_or_owner(func):
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -59,9 +73,9 @@ def admin_or_owner(func):
         owner_id_env = context.bot_data.get('OWNER_ID')
         if owner_id_env and user.id == int(owner_id_env):
             return await func(update, context)
-        # fallback: if not owner, rely on sudo table check in handler if needed
-        # For simplicity: handlers that need DB checks will perform them directly when necessary
-        return await func(update, context)
+        if AUTHZ.is_sudo(user.id) and not AUTHZ.is_banned(user.id):
+            return await func(update, context)
+        await _deny(update, "🔒 သင်မှာ Admin ခွင့်မရှိပါ။")
     return wrapper
 
 def user_allowed(func):
@@ -70,14 +84,20 @@ def user_allowed(func):
         user = update.effective_user
         if not user:
             return
-        # We don't access DB here; handlers should early-check banned/muted using DB helper
+        if AUTHZ.is_banned(user.id):
+            await _deny(update, "🔒 သင့်ကို global ban ထားပါသည်။")
+            return
+        if AUTHZ.is_muted(user.id):
+            # ignored silently, but a button press still needs an answer to stop the spinner
+            if update.callback_query:
+                await update.callback_query.answer()
+            return
         return await func(update, context)
     return wrapper
 
-# pick rarity
+# pick rarity (O(1) draw from the precomputed alias table; seed via random.seed)
 def pick_rarity():
-    keys = [r[0] for r in RARITY_LEVELS]
-    key = random.choices(keys, weights=RARITY_WEIGHTS, k=1)[0]
+    key = RARITY_TABLE.sample(random)
     label = RARITY_LABEL_MAP.get(key, key.title())
     return key, label
 
@@ -96,6 +116,21 @@ def shop_keyboard_for(page_index: int):
     ])
     return kb
 
+# harem keyboard: keyset cursors travel in callback_data (harem:<uid>:<rarity|all>:<n|p>:<id>)
+def harem_keyboard_for(uid: int, rarity_key: Optional[str], first_id: int, last_id: int, has_prev: bool, has_next: bool):
+    rk = rarity_key or "all"
+    keys = ["all"] + [r[0] for r in RARITY_LEVELS]
+    next_filter = keys[(keys.index(rk) + 1) % len(keys)] if rk in keys else "all"
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"harem:{uid}:{rk}:p:{first_id}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"harem:{uid}:{rk}:n:{last_id}"))
+    label = RARITY_LABEL_MAP.get(rk, "🗂 All")
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton(f"🔎 {label}", callback_data=f"harem:{uid}:{next_filter}:n:0")])
+    return InlineKeyboardMarkup(rows)
+
 # extract target user helper (simple)
 async def extract_target_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message and update.message.reply_to_message:
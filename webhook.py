@@ -0,0 +1,126 @@
+# webhook.py
+# aiohttp server that feeds Telegram webhook POSTs straight into the PTB update queue
+# replay recorded updates locally: python3 webhook.py replay updates.jsonl [--url URL] [--secret S]
+import os
+import hmac
+import asyncio
+import logging
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger("catch_character_bot.webhook")
+
+# public https base Telegram should call (e.g. https://bot.example.com); empty = don't call setWebhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+# sent back by Telegram in X-Telegram-Bot-Api-Secret-Token; requests without it are rejected
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# parallel connections Telegram may open to us (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """POST <path> -> Update.de_json -> application.update_queue; GET <path> is a health check.
+
+    Each request only parses and enqueues, so Telegram gets its 200 at once
+    and handlers run with the Application's concurrent_updates limit.
+    """
+
+    def __init__(self, application, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self._runner: Optional[web.AppRunner] = None
+        self._closing = False
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=403)
+        if self._closing:
+            # Telegram retries non-2xx answers, so nothing is lost while we restart
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.warning("bad webhook payload: %s", e)
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok\n")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get(self.path, self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info("webhook listening on http://%s:%d%s", self.listen, self.port, self.path)
+        if WEBHOOK_URL:
+            url = WEBHOOK_URL.rstrip("/") + self.path
+            await self.application.bot.set_webhook(url=url, secret_token=self.secret or None,
+                                                   allowed_updates=Update.ALL_TYPES,
+                                                   max_connections=WEBHOOK_MAX_CONNECTIONS)
+            logger.info("webhook registered at %s", url)
+
+    async def stop(self):
+        """Stop taking updates; ones already enqueued are drained by application.stop()."""
+        self._closing = True
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def replay(path: str, url: str, secret: str = "", concurrency: int = 16) -> int:
+    """POST every update in a JSONL file (one Update object per line) to url; returns how many got 200."""
+    import aiohttp
+
+    with open(path, "r", encoding="utf-8") as fh:
+        updates = [line for line in fh if line.strip()]
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    sem = asyncio.Semaphore(concurrency)
+    ok = 0
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(body: str):
+            nonlocal ok
+            async with sem:
+                async with session.post(url, data=body.encode()) as resp:
+                    if resp.status == 200:
+                        ok += 1
+                    else:
+                        logger.warning("update rejected with %d: %s", resp.status, body.strip()[:120])
+        await asyncio.gather(*[post(u) for u in updates])
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Webhook helpers")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay", help="POST recorded updates (JSONL) to a running webhook")
+    rp.add_argument("file")
+    rp.add_argument("--url", default=f"http://127.0.0.1:{int(os.getenv('WEBHOOK_PORT', '8080'))}"
+                                     f"/{os.getenv('WEBHOOK_PATH', 'telegram').strip('/')}")
+    rp.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    rp.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    sent = asyncio.run(replay(args.file, args.url, args.secret, args.concurrency))
+    print(f"{sent} updates accepted")